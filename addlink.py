@@ -1,10 +1,10 @@
 #!/usr/bin/python3
 import os
 import sys
-import csv
 import time
 import codecs
-from shaarpli.data import CSV_PARAMS
+from shaarpli.data import HandlerAggregator, new_handler
+from shaarpli.commons import Link
 from shaarpli import config
 
 CONFIG = config.get()
@@ -16,21 +16,30 @@ except IndexError:
     exit(1)
 
 print('ENCODING:', sys.stdout.encoding)
-# extract data
+# extract data: title, url, optional "tags:" line, then body
 with codecs.open(DATA_TO_ADD, 'r', encoding='utf_8_sig') as fd:
     title = next(fd).strip()
     url = next(fd).strip()
     body = fd.read().strip()
     pubdate = int(time.time())
+    tags = ''
+    if body.lower().startswith('tags:'):
+        tags, _, body = body.partition('\n')
+        tags, body = tags[len('tags:'):], body.strip()
 
 
 # write data into database
 WORKING_DIR = os.path.dirname(os.path.realpath(sys.argv[0]))
 os.chdir(WORKING_DIR)
 
-# NB: do not append the utf-8-sig at start (the codec is dumb: it would add it at the end)
-with codecs.open(DATABASE, 'a', encoding='utf_8') as fd:
-    writer = csv.writer(fd, **CSV_PARAMS)
-    writer.writerow((title, body, url, pubdate))
+# NB: written in utf-8 without signature, while holding the database lock
+new_handler(CONFIG, DATABASE, queue=True).extend(
+    [Link(title, body, url, pubdate, tags)]
+)
 
 print('DONE:', title)
+
+# update the static site, if any
+if CONFIG.export.directory:
+    HandlerAggregator(CONFIG).export()
+    print('EXPORTED:', CONFIG.export.directory)
@@ -0,0 +1,10 @@
+"""Benchmarks of the hot paths of data access and rendering.
+
+usage: python3 -m benchmark [--sizes 1000,100000] [--formats dsv,binary,sqlite] [--output results.json]
+
+Databases of given sizes and formats are generated (see generate.py),
+then each case (see cases.py) is timed in its own process, on its own copy
+of the databases. Results are written as JSON: for each case, format and size,
+ops/s, latency percentiles in milliseconds and peak RSS in KiB.
+
+"""
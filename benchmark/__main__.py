@@ -0,0 +1,94 @@
+"""Run the benchmark, and write its results as JSON (see __init__.py)"""
+
+
+import os
+import sys
+import json
+import itertools
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+from benchmark.generate import generate
+from benchmark.cases import CASES, run_case
+
+
+def commit() -> str or None:
+    """Return the commit of the code being benchmarked, if known"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    names = args.cases.split(',') if args.cases else tuple(CASES)
+    context = multiprocessing.get_context('spawn')  # no memory inherited
+    report = {
+        'commit': commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    os.makedirs(args.workdir, exist_ok=True)
+    sizes = tuple(map(int, args.sizes.split(',')))
+    for database_format, size in itertools.product(args.formats.split(','), sizes):
+        print('generating', size, 'links in', database_format, 'format…', file=sys.stderr)
+        site = os.path.dirname(generate(os.path.join(args.workdir, database_format, str(size)),
+                                        size, database_format=database_format))
+        for name in names:
+            with tempfile.TemporaryDirectory(dir=args.workdir) as directory:
+                shutil.copytree(os.path.join(site, 'data'), os.path.join(directory, 'data'))
+                shutil.copytree(args.templates, os.path.join(directory, 'templates'))
+                results = context.Queue()
+                process = context.Process(target=run_case,
+                                          args=(name, directory, args.max_seconds, results))
+                process.start()
+                process.join()
+                if process.exitcode:
+                    raise RuntimeError('case {} failed on {} links'.format(name, size))
+                result = results.get()
+            if result is None:
+                print('{:>20} {:>6} {:>8}: does not apply'.format(name, database_format, size),
+                      file=sys.stderr)
+                continue
+            report['results'].append({'case': name, 'format': database_format,
+                                      'size': size, **result})
+            print('{:>20} {:>6} {:>8}: {:10.1f} ops/s, p50 {:.3f} ms'.format(
+                name, database_format, size, result['ops_per_s'] or 0,
+                result['latency_ms']['p50']
+            ), file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output)
+    else:
+        print(output)
+
+
+def parse_args(argv:list=None):
+    parser = argparse.ArgumentParser(prog='python3 -m benchmark', description=__doc__)
+    parser.add_argument('--sizes', default='1000,100000',
+                        help='comma separated numbers of published links (like 1000,100000,1000000)')
+    parser.add_argument('--cases', default='', help='comma separated cases to run (default: all)')
+    parser.add_argument('--formats', default='dsv',
+                        help='comma separated formats of the databases (like dsv,binary,sqlite)')
+    parser.add_argument('--output', help='file receiving the JSON results (default: stdout)')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'shaarpli-benchmark'),
+                        help='where generated databases are kept between runs')
+    parser.add_argument('--templates', default='templates', help='directory of the templates')
+    parser.add_argument('--max-seconds', type=float, default=10.,
+                        help='maximal duration of a case, ignoring its number of operations')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args())
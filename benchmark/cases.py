@@ -0,0 +1,172 @@
+"""Cases of the benchmark, each one being a hot path of shaarpli.
+
+A case is a function called in the directory of a generated site.
+It returns the operation to time, and a function to call
+before each operation, untimed, or None. It returns None instead
+if the case does not apply to the format of the database.
+run_case times a case.
+
+"""
+
+
+import os
+import time
+import random
+import resource
+import itertools
+import contextlib
+
+from shaarpli.commons import Link
+
+
+CASES = {}  # name -> (function building the case, maximal number of operations)
+PERCENTILES = (50, 90, 99)
+
+
+def case(iterations:int):
+    """Register the decorated function as a case of given number of operations"""
+    def decorator(func):
+        CASES[func.__name__] = func, iterations
+        return func
+    return decorator
+
+
+def new_links() -> callable:
+    """Return a function returning a new link at each call"""
+    counter = itertools.count()
+    return lambda: Link('new link', 'benchmark', 'https://example.org/new', 2000000000 + next(counter))
+
+
+def clear_caches(core):
+    from shaarpli import template
+    with core.LOCK:
+        core.PAGES.invalidate()
+        core.RENDERING.invalidate()
+    if template.FRAGMENTS is not None:
+        template.FRAGMENTS.clear()
+
+
+@case(iterations=10)
+def extend():
+    from shaarpli import core
+    new_link = new_links()
+    return lambda: core.DB.target.extend([new_link()]), None
+
+
+@case(iterations=10)
+def extend_memwise():
+    from shaarpli import core, data
+    new_link, target = new_links(), core.DB.target
+    if not isinstance(target, data.DatabaseHandler):
+        return None
+    return lambda: data.extend_memwise([new_link()], target.name, target.record_format), None
+
+
+@case(iterations=10)
+def extend_timewise():
+    from shaarpli import core, data
+    new_link, target = new_links(), core.DB.target
+    if not isinstance(target, data.DatabaseHandler):
+        return None
+    return lambda: data.extend_timewise([new_link()], target.name, target.record_format), None
+
+
+@case(iterations=10)
+def move_entry():
+    from shaarpli import core
+    return lambda: core.DB.move_entry(1), None
+
+
+@case(iterations=200)
+def create_page_shallow():
+    from shaarpli import core
+    return (lambda: core.create_page(1, core.CONFIG, core.DB),
+            lambda: core.PAGES.invalidate())
+
+
+@case(iterations=50)
+def create_page_deep():
+    from shaarpli import core
+    size = int(core.CONFIG.html.link_per_page)
+    last_page = max(1, core.DB.nb_link() // size)
+    return (lambda: core.create_page(last_page, core.CONFIG, core.DB),
+            lambda: core.PAGES.invalidate())
+
+
+@case(iterations=200)
+def render_full_page():
+    from shaarpli import core, template
+    links = core.DB.page(1, int(core.CONFIG.html.link_per_page))
+    return (lambda: template.render_full_page(core.CONFIG, 1, links, core.DB),
+            lambda: clear_caches(core))
+
+
+@case(iterations=5)
+def scan():
+    from shaarpli import core
+    return lambda: sum(1 for link in core.DB.target.links_from(0) if link.title), None
+
+
+@case(iterations=200)
+def random_access():
+    from shaarpli import core
+    rng, nb = random.Random(42), core.DB.nb_link()
+    return lambda: tuple(core.DB.target.links_by_id(rng.sample(range(nb), 10))), None
+
+
+@case(iterations=1000)
+def nb_link():
+    from shaarpli import core
+    return core.DB.nb_link, core.DB.target._changed
+
+
+@case(iterations=200)
+def page_for_cold():
+    from shaarpli import core
+    env = {'REQUEST_URI': '/links/1'}
+    return lambda: core.page_for(env), lambda: clear_caches(core)
+
+
+@case(iterations=1000)
+def page_for_warm():
+    from shaarpli import core
+    env = {'REQUEST_URI': '/links/1'}
+    core.page_for(env)
+    return lambda: core.page_for(env), None
+
+
+def percentile(latencies:list, percent:int) -> float:
+    """Return given percentile of given sorted latencies (nearest rank)"""
+    return latencies[max(0, -(-len(latencies) * percent // 100) - 1)]
+
+
+def run_case(name:str, directory:str, max_seconds:float, results):
+    """Time given case in given directory, and put its result in given queue.
+    Expected to run in its own process."""
+    os.chdir(directory)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        build, iterations = CASES[name]
+        built = build()
+        if built is None:  # does not apply
+            results.put(None)
+            return
+        operation, before = built
+        latencies = []
+        start = time.perf_counter()
+        while len(latencies) < iterations and time.perf_counter() - start < max_seconds:
+            if before:
+                before()
+            begin = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    results.put({
+        'iterations': len(latencies),
+        'ops_per_s': len(latencies) / sum(latencies) if sum(latencies) else None,
+        'latency_ms': dict(
+            (('p{}'.format(percent), percentile(latencies, percent) * 1000)
+             for percent in PERCENTILES),
+            max=latencies[-1] * 1000
+        ),
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
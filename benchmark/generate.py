@@ -0,0 +1,79 @@
+"""Generation of reproducible synthetic databases.
+
+A generated directory holds a data/ directory as expected by shaarpli:
+config.ini, data.csv (published links, newest first) and topublish.csv
+(links waiting for autopublish), with their indexes and search index.
+In binary and SQLite formats (see shaarpli/records.py and storage.py),
+they are data.bin and topublish.bin, or data.sqlite and topublish.sqlite.
+
+"""
+
+
+import os
+import random
+import configparser
+
+from shaarpli import config as config_module
+from shaarpli.commons import Link
+from shaarpli.data import EXTENSIONS, new_handler
+from shaarpli.search import SearchIndex
+
+
+SEED = 42
+WORDS = tuple('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod'
+              ' tempor incididunt ut labore et dolore magna aliqua python link shaarpli'.split())
+TAGS = ('python', 'web', 'cli', 'data', 'markdown', 'cache')
+START_DATE = 1200000000
+CONFIG = """\
+[server]
+url = /links
+
+[database]
+filepath = data/data{ext}
+format = {format}
+
+[autopublish]
+active = true
+filepath = data/topublish{ext}
+every = year
+"""
+
+
+def links(nb:int, start_date:int, newest_first:bool=False) -> iter:
+    """Yield *nb* synthetic links, from the oldest or the newest.
+    A link depends only on its date, whatever the order."""
+    for nb in (range(nb - 1, -1, -1) if newest_first else range(nb)):
+        rng = random.Random('{}-{}'.format(SEED, start_date + nb * 600))
+        words = lambda k: ' '.join(rng.choices(WORDS, k=k))
+        yield Link(
+            words(5).capitalize(),
+            '\n'.join(words(12) for _ in range(rng.randint(1, 4))),
+            'https://example.org/{}/{}'.format(rng.choice(WORDS), nb),
+            start_date + nb * 600,
+            rng.sample(TAGS, rng.randint(0, 2))
+        )
+
+
+def generate(directory:str, nb_published:int, nb_unpublished:int=None,
+             database_format:str='dsv') -> str:
+    """Generate the data of a site in given directory, if not already there.
+    Return the data directory."""
+    datadir = os.path.join(directory, 'data')
+    if os.path.exists(os.path.join(datadir, 'config.ini')):
+        return datadir
+    os.makedirs(datadir, exist_ok=True)
+    if nb_unpublished is None:
+        nb_unpublished = max(1, nb_published // 10)
+    config_text = CONFIG.format(ext=EXTENSIONS[database_format], format=database_format)
+    parser = configparser.ConfigParser()
+    parser.read_string(config_module.DEFAULT_CONFIG)
+    parser.read_string(config_text)
+    config = config_module.as_namedtuple(parser)
+    target = new_handler(config, os.path.join(directory, config.database.filepath))
+    target.rewrite(links(nb_published, START_DATE, newest_first=not target.newest_last))
+    source = new_handler(config, os.path.join(directory, config.autopublish.filepath), queue=True)
+    source.rewrite(links(nb_unpublished, START_DATE + nb_published * 600))
+    SearchIndex(target).update(offline=True)
+    with open(os.path.join(datadir, 'config.ini'), 'w') as fd:
+        fd.write(config_text)  # last: the data is complete
+    return datadir
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""One-shot conversion of the database to another storage.
+
+usage: convertdb.py append_only
+       convertdb.py newest_first
+       convertdb.py dsv
+       convertdb.py binary
+       convertdb.py sqlite
+
+append_only -- database storing the newest link first is converted
+               into one storing it last (database.append_only = true)
+newest_first -- the way back (database.append_only = false)
+dsv, binary, sqlite -- database, and autopublish database if any, are written
+                       in given format, next to them with the .csv, .bin
+                       or .sqlite extension (database.format).
+                       Links already published from the autopublish
+                       database are dropped. The search index of the
+                       converted database is built.
+
+"""
+import os
+import sys
+from shaarpli import data
+from shaarpli import config
+from shaarpli import records
+from shaarpli.search import SearchIndex
+from shaarpli.storage import SQLITE
+from shaarpli.index import OffsetIndex, file_lock, tempname
+
+CONFIG = config.get()
+DATABASE = CONFIG.database.filepath
+try:
+    TARGET = sys.argv[1]
+except IndexError:
+    TARGET = None
+
+if TARGET not in {'append_only', 'newest_first', *data.EXTENSIONS}:
+    print(__doc__)
+    exit(1)
+
+if TARGET in data.EXTENSIONS:
+    databases = {'database': (DATABASE, False)}
+    if os.path.exists(CONFIG.autopublish.filepath):
+        databases['autopublish'] = (CONFIG.autopublish.filepath, True)
+    for section, (database, queue) in databases.items():
+        target = os.path.splitext(database)[0] + data.EXTENSIONS[TARGET]
+        if os.path.abspath(target) == os.path.abspath(database):
+            print('ERROR: {} is already in {} format.'.format(database, TARGET))
+            exit(1)
+        source = data.new_handler(CONFIG, database, queue=queue)
+        if SQLITE in {TARGET, CONFIG.database.format}:  # links are written again
+            converted = data.new_handler(CONFIG, target, queue=queue, database_format=TARGET)
+            newest_first = not (queue or converted.newest_last)
+            nb_link = converted.rewrite(source.links if newest_first else source.links_oldest_first())
+        else:  # records are copied as they are
+            if queue:  # the published links are before the head cursor, that is not converted
+                source.compact()
+            with file_lock(database):
+                converted = tempname(target)
+                nb_link = records.convert(database, source.record_format,
+                                          converted, records.get(TARGET))
+                os.replace(converted, target)
+            OffsetIndex(target, records.get(TARGET)).refresh()
+        if not queue:
+            SearchIndex(data.new_handler(CONFIG, target, database_format=TARGET)).update(offline=True)
+        print('DONE: {} links of {} written in {}. Do not forget to set {}.filepath'
+              ' to {}.'.format(nb_link, database, target, section, target))
+    print('Do not forget to set database.format to {} in config.'.format(TARGET))
+elif CONFIG.database.format == SQLITE:
+    print('ERROR: links of a SQLite database are not stored in a file.')
+    exit(1)
+else:
+    data.reverse_database(DATABASE, records.get(CONFIG.database.format))
+    print('DONE: {} converted to {}. Do not forget to set database.append_only'
+          ' to {} in config.'.format(DATABASE, TARGET, str(TARGET == 'append_only').lower()))
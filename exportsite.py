@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+"""Export the site as static files, to be served without python.
+
+usage: exportsite.py [directory]
+
+directory -- where to write the pages. Defaults to export.directory in config.
+
+Only the pages that changed since last export are written.
+Once export.directory is set in config, the export is also performed
+at each publication, in a thread of the server.
+The subtitle is included by the pages with a Server Side Include
+directive: enable SSI on the server of the exported site (see export.py).
+
+"""
+import sys
+from shaarpli import config
+from shaarpli.data import HandlerAggregator
+from shaarpli.export import export_site
+
+CONFIG = config.get()
+DIRECTORY = sys.argv[1] if len(sys.argv) > 1 else CONFIG.export.directory
+
+if not DIRECTORY:
+    print(__doc__)
+    exit(1)
+
+nb_written = export_site(CONFIG, HandlerAggregator(CONFIG), DIRECTORY)
+print('DONE: {} files written in {}.'.format(nb_written, DIRECTORY))
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+"""Import many links at once in the database, from the dump of another tool.
+
+usage: importlinks.py <file> [format]
+
+file -- the dump to import
+format -- one of jsonl, csv or netscape (bookmark HTML export).
+          Guessed from the file extension by default.
+
+Links are sorted by date with the ones already in database,
+and the database is rewritten once. The search index is then built again.
+
+"""
+import sys
+import time
+from shaarpli import config
+from shaarpli import importer
+from shaarpli.data import HandlerAggregator
+
+CONFIG = config.get()
+try:
+    DUMP = sys.argv[1]
+except IndexError:
+    print(__doc__)
+    exit(1)
+FORMAT = sys.argv[2] if len(sys.argv) > 2 else importer.guess_format(DUMP)
+
+if FORMAT not in importer.READERS:
+    print(__doc__)
+    exit(1)
+
+DB = HandlerAggregator(CONFIG)
+start = time.perf_counter()
+with open(DUMP, encoding='utf_8_sig', newline='') as fd:
+    nb_imported = importer.import_links(importer.READERS[FORMAT](fd), DB.target)
+duration = time.perf_counter() - start
+print('DONE: {} links imported in {:.2f}s ({:.0f} links/s), {} links in {}.'.format(
+    nb_imported, duration, nb_imported / max(duration, 1e-9), DB.nb_link(), DB.name
+))
+DB.search_index.update(offline=True)
+print('INDEXED: search index of {} is up to date.'.format(DB.name))
+
+# update the static site, if any
+if CONFIG.export.directory:
+    DB.export()
+    print('EXPORTED:', CONFIG.export.directory)
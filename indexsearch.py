@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+"""Build the search index of the database, or bring it up to date.
+
+usage: indexsearch.py
+
+While answering requests, shaarpli indexes only the few links published
+since last update: the whole database is indexed by this script,
+after the first run or once the database was rewritten (see search.py).
+
+"""
+import sys
+import time
+from shaarpli import config
+from shaarpli.data import HandlerAggregator
+
+CONFIG = config.get()
+if len(sys.argv) > 1:
+    print(__doc__)
+    exit(1)
+
+DB = HandlerAggregator(CONFIG)
+start = time.perf_counter()
+DB.search_index.update(offline=True)
+print('DONE: {} links of {} indexed in {:.2f}s.'.format(
+    DB.nb_link(), DB.name, time.perf_counter() - start
+))
@@ -1,11 +1,64 @@
 """Entry point of the app.
 
+application is the WSGI entry point, asgi_application the ASGI one.
+Both use core to answer ; the ASGI one runs it in a pool of threads,
+so that file accesses and rendering do not block the event loop.
+
 """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from shaarpli import core
 
 
+EXECUTOR = ThreadPoolExecutor(max_workers=int(core.CONFIG.server.asgi_threads))
+
+
 def application(env, start_response):
     """Called by server on user question"""
-    start_response('200 OK', [('Content-Type','text/html')])
-    return core.page_for(env).encode()
+    status, headers, body = core.page_for(env).for_request(env)
+    start_response(status, headers)
+    return body
+
+
+async def asgi_application(scope, receive, send):
+    """Called by ASGI server on user question"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    env = asgi_environ(scope)
+    response = core.stale_response(env)
+    if response is None:
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(EXECUTOR, core.page_for, env)
+    status, headers, body = response.for_request(env)
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split()[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': b''.join(body)})
+
+
+def asgi_environ(scope) -> dict:
+    """Return the CGI environnement equivalent to given ASGI scope"""
+    path = scope.get('raw_path') or scope['path'].encode()
+    query = scope.get('query_string', b'')
+    env = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'REQUEST_URI': (path + (b'?' + query if query else b'')).decode('latin-1'),
+        'QUERY_STRING': query.decode('latin-1'),
+    }
+    for name, value in scope.get('headers', ()):
+        key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+        env[key] = value.decode('latin-1')
+    return env
@@ -1,31 +1,269 @@
-"""Subclass of cachetools.LFUCache implementing a feedback solution.
+"""Subclass of cachetools.LFUCache implementing a feedback solution,
+and cache shared between processes.
+
+Both implements the CacheInterface expected by core.
+Which one is used is defined by server.cache_backend in config:
+- memory: SLFUCache, local to the process, bounded by the memory used
+  by its entries. Caches of core share server.cache_memory bytes.
+- shared: SharedCache, in server.cache_directory, used by all processes,
+  bounded by its number of entries (server.cache_size)
 
 """
 
+import os
+import sys
+import pickle
+import shutil
+import hashlib
 import collections
+import collections.abc
 from cachetools import LFUCache
 
+from shaarpli.index import tempname
+
+
+class CacheInterface:
+    """Methods expected from a cache, in addition to the mapping ones.
+
+    Lookups made with get() are counted as hits or misses,
+    the ones made with peek() are not.
+    Values are expected not to change once stored: the memory they use
+    is computed once, and a shared cache stores copies of them.
+
+    """
+    hits = misses = evictions = 0
+
+    def get(self, key, default=None):
+        """Return the value of given key, or default if not in cache"""
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """Return the value of given key, or default if not in cache,
+        without counting it: for lookups checking again a counted one"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def stats(self) -> dict:
+        """Return the counters of the cache, since the process started"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self)}
+
+    def invalidate(self):
+        """Remove all entries, for all users of the cache"""
+        raise NotImplementedError
+
+    def html_repr(self) -> str:
+        raise NotImplementedError
+
+
+def sizeof(value) -> int:
+    """Return the memory used by given value in bytes,
+    including the values of a tuple"""
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(map(sizeof, value))
+    return sys.getsizeof(value)
 
-class SLFUCache(LFUCache):
+
+class MemoryBudget:
+    """Memory shared by several SLFUCache.
+
+    Once their entries use more than *limit* bytes, the least frequently
+    used entries of the largest cache are evicted.
+
+    """
+
+    def __init__(self, limit:int):
+        self.limit = int(limit)
+        self.caches = []
+
+    def used(self) -> int:
+        return sum(cache.currsize for cache in self.caches)
+
+    def enforce(self):
+        while self.used() > self.limit:
+            largest = max(self.caches, key=lambda cache: cache.currsize)
+            largest.popitem()
+            largest.evictions += 1
+
+
+class SLFUCache(CacheInterface, LFUCache):
     """Expose the cache, and provides high-level representation of data.
 
-    - number of hit
-    - number of miss
+    - number of hit, miss and eviction (see stats)
+    - memory used by the entries, in bytes, bounded by maxsize
     - a barplot of the LFU (x: sorted keys of the dict ; y: number of access)
 
+    getsizeof -- function giving the memory used by an entry
+    budget -- MemoryBudget shared with other caches, if any
+
+    Entries larger than maxsize are not kept.
+
     """
 
-    def __init__(self, maxsize:int):
-        super().__init__(int(maxsize))
+    def __init__(self, maxsize:int, getsizeof:callable=sizeof, budget:MemoryBudget=None):
+        super().__init__(int(maxsize), getsizeof=getsizeof)
+        self.budget = budget
+        if budget:
+            budget.caches.append(self)
+
+    def __setitem__(self, key, value):
+        if self.getsizeof(value) > self.maxsize:  # would not fit alone
+            self.pop(key, None)
+            return
+        expected_size = len(self) + (key not in self)
+        super().__setitem__(key, value)
+        self.evictions += expected_size - len(self)  # removed to make room
+        if self.budget:
+            self.budget.enforce()
+
+    def clear(self):
+        """Remove all entries at once, instead of looking
+        for the least frequently used one to remove at each step"""
+        self._Cache__data.clear()
+        self._Cache__size.clear()
+        self._Cache__currsize = 0
+        self._LFUCache__counter.clear()
 
-    def clear_cache(self):
-        self.__data = {}
-        self.__size = {}
-        self.__counter = collections.Counter()
-        self.__currsize = 0
+    def invalidate(self):
+        self.clear()
+
+    def stats(self) -> dict:
+        return dict(super().stats(), bytes=self.currsize)
 
     @property
-    def counts(self) -> dict: return dict(self.__counter)
+    def counts(self) -> dict: return dict(self._LFUCache__counter)
+
+    def html_repr(self) -> str:
+        return '{}: {}'.format(self.stats(), {k: abs(v) for k, v in self.counts.items()})
+
+
+class SharedCache(CacheInterface, collections.abc.MutableMapping):
+    """Cache stored in a directory, so that all processes
+    (like uwsgi workers) share its entries.
+
+    Entries are pickled, the key followed by the value, in files named
+    after the hash of their key, in a subdirectory named after the current
+    generation. Invalidation is a move to the next generation, seen by all
+    processes at their next access.
+    When more than *maxsize* entries are stored, the oldest ones are removed.
+
+    """
+
+    def __init__(self, maxsize:int, directory:str, namespace:str):
+        self.maxsize = int(maxsize)
+        self.directory = os.path.join(directory, namespace)
+        self.generation_file = os.path.join(self.directory, 'generation')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def generation(self) -> int:
+        try:
+            with open(self.generation_file) as fd:
+                return int(fd.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _dir(self, generation:int=None) -> str:
+        generation = self.generation() if generation is None else generation
+        return os.path.join(self.directory, str(generation))
+
+    def _file(self, key) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self._dir(), digest)
+
+    def __getitem__(self, key):
+        try:
+            with open(self._file(key), 'rb') as fd:
+                if pickle.load(fd) != key:  # same hash
+                    raise KeyError(key)
+                return pickle.load(fd)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if self.maxsize <= 0:
+            return
+        filename = self._file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = tempname(filename)
+        with open(tmp, 'wb') as fd:
+            pickle.dump(key, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+        self._evict(os.path.dirname(filename))
+
+    def _evict(self, directory:str):
+        """Remove the oldest entries until there is at most maxsize entries"""
+        entries = [entry for entry in os.scandir(directory) if not entry.name.endswith('.tmp')]
+        if len(entries) > self.maxsize:
+            entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+            for entry in entries[:len(entries) - self.maxsize]:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:  # removed by another process
+                    continue
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        try:
+            with open(self._file(key), 'rb') as fd:
+                return pickle.load(fd) == key  # the value is not read
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False
+
+    def _names(self) -> list:
+        try:
+            return [name for name in os.listdir(self._dir()) if not name.endswith('.tmp')]
+        except FileNotFoundError:
+            return []
+
+    def __iter__(self):
+        directory, keys = self._dir(), []
+        for name in self._names():
+            try:
+                with open(os.path.join(directory, name), 'rb') as fd:
+                    keys.append(pickle.load(fd))  # the value is not read
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                continue  # removed meanwhile
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return len(self._names())
+
+    def invalidate(self):
+        generation = self.generation()
+        tmp = tempname(self.generation_file)
+        with open(tmp, 'w') as fd:
+            fd.write(str(generation + 1))
+        os.replace(tmp, self.generation_file)
+        shutil.rmtree(self._dir(generation), ignore_errors=True)
 
     def html_repr(self) -> str:
-        return str({k: abs(v) for k, v in self._LFUCache__counter.items()})
+        return 'generation {}: {}'.format(self.generation(), sorted(self, key=repr))
+
+
+def new_cache(config, namespace:str, budget:MemoryBudget=None) -> CacheInterface:
+    """Return a new cache according to given configuration.
+
+    namespace -- name of the cache, distinguishing the shared caches
+    budget -- memory shared with other caches, if not shared between processes.
+              By default, the cache can use server.cache_memory bytes.
+
+    """
+    if config.server.cache_backend == 'shared':
+        return SharedCache(config.server.cache_size,
+                           config.server.cache_directory, namespace)
+    return SLFUCache(budget.limit if budget else config.server.cache_memory, budget=budget)
@@ -3,51 +3,122 @@
 """
 
 
+import os
+import re
+import sys
 import time
 import tempfile as tempfile_module
 
 
+TAG_SEP = re.compile(r'[,\s]+')
+
+
+def parse_tags(tags:str or iter) -> tuple:
+    """Return the tags found in given text or iterable, without duplicates
+
+    >>> parse_tags('python, web #cli python')
+    ('python', 'web', 'cli')
+    >>> parse_tags('')
+    ()
+
+    """
+    if isinstance(tags, str):
+        tags = TAG_SEP.split(tags)
+    return tuple(dict.fromkeys(tag.strip().lstrip('#') for tag in tags
+                               if tag.strip().lstrip('#')))
+
+
 class Link():
-    """A link with text, a title and publication date.
+    """A link with text, a title, publication date and optional tags.
+
+    Tags are stored in a fifth field, only if there is any,
+    so databases without tags are written as before.
+
+    Fields are kept as found in the database, in a tuple or a record
+    decoding them on access (see records.BinaryRow):
+    publication date and tags are decoded at first access only,
+    so links read only to be cached or skipped stay small.
+
     """
+    __slots__ = ('_row', '_publication_date', '_tags')
 
-    def __init__(self, title, description, url, publication_date):
-        self._title = str(title)
-        self._description = str(description)
-        self._url = str(url)
+    def __init__(self, title, description, url, publication_date, tags=()):
+        self._row = (str(title), str(description), str(url))
         self._publication_date = int(float(publication_date))
+        self._tags = parse_tags(tags)
 
     def __iter__(self):
-        return iter((self._title, self._description,
-                     self._url, self._publication_date))
+        return iter((self.title, self.description,
+                     self.url, self.publication_date))
+
+    def __sizeof__(self):
+        fields = self._row if isinstance(self._row, tuple) else ()  # else sized by the row
+        return (object.__sizeof__(self) + sys.getsizeof(self._row)
+                + sum(map(sys.getsizeof, fields))
+                + sum(map(sys.getsizeof, self._tags or ())))
 
     def publish(self):
         """Update publication_date to now"""
         self._publication_date = time.time()
 
+    @staticmethod
+    def check(line):
+        """Raise ValueError if given record is not a link: if the number
+        of fields is wrong, or if the publication date is not a number"""
+        if not 4 <= len(line) <= 5:
+            raise ValueError('expected 4 or 5 fields, got {}'.format(len(line)))
+        float(line[3])  # raise ValueError if not a date
+
     @staticmethod
     def from_dsv(line):
-        return Link(*line)
+        """Return the link of given record, checked first (see check),
+        so that invalid records are dropped where they are read"""
+        Link.check(line)
+        return Link.from_record(line)
+
+    @staticmethod
+    def from_record(line):
+        """Return the link of given record, known to be valid
+        (like the indexed ones), whose fields are decoded when accessed.
+
+        The record is kept as is, unless it is a list (as given by csv).
+
+        """
+        link = Link.__new__(Link)
+        link._row = tuple(line) if isinstance(line, list) else line
+        link._publication_date = link._tags = None
+        return link
 
     def to_dsv(self) -> tuple:
-        return tuple(self)
+        return tuple(self) + ((' '.join(self.tags),) if self.tags else ())
 
     def asdict(self) -> dict:
         return {
-            'title': self._title,
-            'description': self._description,
-            'url': self._url,
-            'publication_date': self._publication_date,
+            'title': self.title,
+            'description': self.description,
+            'url': self.url,
+            'publication_date': self.publication_date,
+            'tags': self.tags,
         }
 
     @property
-    def title(self) -> str: return self._title
+    def title(self) -> str: return self._row[0]
     @property
-    def description(self) -> str: return self._description
+    def description(self) -> str: return self._row[1]
     @property
-    def url(self) -> str: return self._url
+    def url(self) -> str: return self._row[2]
+
     @property
-    def publication_date(self) -> int: return self._publication_date
+    def publication_date(self) -> int:
+        if self._publication_date is None:
+            self._publication_date = int(float(self._row[3]))
+        return self._publication_date
+
+    @property
+    def tags(self) -> tuple:
+        if self._tags is None:
+            self._tags = parse_tags(self._row[4]) if len(self._row) > 4 else ()
+        return self._tags
 
     def __str__(self):
         return '{}: {}: <a href="{}">{}</a><br>'.format(
@@ -66,6 +137,16 @@ def file_content(filename:str, onfail='') -> str:
     return content
 
 
+def file_state(filename:str) -> tuple or None:
+    """Return (mtime in ns, size, inode) of given file, or None
+    if filename is not found. Changes when the file is modified or replaced."""
+    try:
+        stat = os.stat(filename)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
 def tempfile() -> str:
     """Return the name of a writable temporary file"""
     return tempfile_module.NamedTemporaryFile(delete=False).name
@@ -14,7 +14,15 @@ DEFAULT_CONFIG = """\
 [server]
 url = localhost
 cache_size = 128
+cache_memory = 33554432
 cache_link = true
+fragment_cache_memory = 4194304
+cache_control = no-cache
+cache_backend = memory
+cache_directory = data/cache
+asgi_threads = 4
+stale_while_revalidate = false
+slow_request_ms = 0
 
 [html]
 link_per_page = 10
@@ -27,24 +35,40 @@ link = templates/link.mkd
 page = templates/page.mkd
 link_separator = templates/link_separator.mkd
 time_format = %%d/%%m/%%Y at %%H:%%M:%%S
+reload_delay = 1
 
 [database]
 filepath = data/data.csv
+format = dsv
 loopkup_timestamp = 1
 memory_wise = true
+append_only = false
+check_delay_ms = 500
 
 [autopublish]
 active = false
 filepath = data/topublish.csv
 every = day
 link_per_publication = 1
+compaction_threshold = 1048576
 message_2 = One link per {every} for the next {remaining} {every}s.
 message_1 = One link per {every} until tomorrow.
 message_0 = One link per {every}, now paused.
 message_noautopublish = powered by shaarpli
+
+[export]
+directory =
+
+[feed]
+size = 20
 """
 
 
+def boolean(value:str) -> bool:
+    """Return the boolean value of given config option value"""
+    return configparser.ConfigParser.BOOLEAN_STATES.get(str(value).lower(), False)
+
+
 def as_namedtuple(config:configparser.ConfigParser) -> namedtuple:
     def namedtuple_of_section(section):
         """Return namedtuple containing fields and their values
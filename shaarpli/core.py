@@ -2,15 +2,47 @@
 
 Allow caching.
 
+page_for is thread-safe, and requests are answered concurrently.
+A page is rendered by only one thread at a time,
+the other threads asking for it waiting for the result (see single_flight),
+or receiving the page as it was before invalidation.
+LOCK only guards the caches: the database is read and written without it,
+writers being serialized by the lock of the database (see data.py).
+During the move of links by autopublish, stale_response gives the cached
+response of a page without waiting for the move to finish, nor for LOCK.
+
+Cached pages are invalidated once the generation of the database
+they were rendered from is not the current one anymore.
+
+Pages are numbered from the newest link: /links/1 is the newest page.
+Archive pages are numbered from the oldest link: /links/archive/1 is the oldest
+page, and /links/archive the newest. Once full, an archive page never changes,
+so publications only invalidate the newest archive pages
+(all of them are invalidated if the database is rewritten).
+Search results are pages too: /links/search/<words>/2 is the second page
+of the links containing all given words, and /links/tag/<name>/2 the second
+page of the links having given tag. Publications only invalidate the pages
+of the tags of published links.
+Feeds of the newest links are /links/feed.atom and /links/feed.rss. They are
+built and compressed once per generation of the database.
+
+Requests are timed (see metrics.py), and /links/metrics exposes the timings
+and the counters of the caches to Prometheus.
+
 """
 
-from itertools import islice
+import threading
+import itertools
+from urllib.parse import quote, unquote_plus
 
 from shaarpli import data as data_module
 from shaarpli import config as config_module
 from shaarpli import template
-from shaarpli.cache import SLFUCache
+from shaarpli import cache
+from shaarpli import feed
+from shaarpli import metrics
 from shaarpli.commons import Link
+from shaarpli.response import Response
 
 
 REDIRECTION = '<meta http-equiv="refresh" content="0; url={}" />'
@@ -19,52 +51,112 @@ UNIQID = 0
 # GLOBAL DATA (conserved between two calls)
 CONFIG = config_module.get()
 DB = data_module.HandlerAggregator(CONFIG)
-LAST_LINK_RENDERED = None
-PAGES = SLFUCache(CONFIG.server.cache_size)
-RENDERING = SLFUCache(CONFIG.server.cache_size)
-
-
-def page_for(env) -> str:
+BUDGET = cache.MemoryBudget(CONFIG.server.cache_memory)  # shared by in-memory caches
+PAGES = cache.new_cache(CONFIG, 'pages', BUDGET)  # page number -> tuple of Link
+RENDERING = cache.new_cache(CONFIG, 'rendering', BUDGET)  # page number -> Response
+ARCHIVES = cache.new_cache(CONFIG, 'archives', BUDGET)  # archive page number -> (html, Response)
+ARCHIVED = None  # publication state of the database when ARCHIVES were last validated
+TAGS = cache.new_cache(CONFIG, 'tags', BUDGET)  # (tag, page number) -> (html, Response)
+TAGGED = None  # publication state of the database when TAGS were last validated
+FEEDS = cache.new_cache(CONFIG, 'feeds', BUDGET)  # feed format -> Response
+LOCK = threading.RLock()  # held while accessing caches, never while accessing database
+PUBLISHING = None  # page number -> Response cached when autopublish began moving links, or None
+PUBLISHER = threading.Lock()  # held by the thread moving links by autopublish
+IN_FLIGHT = {}  # key -> Flight, for the renderings in progress
+STALE = {}  # page number -> Response, for pages invalidated since rendered
+
+
+class Flight:
+    """A computation in progress, whose result is awaited by other threads"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, compute:callable):
+    """Return the result of compute(). Threads asking for the same key
+    at the same time share a single call to compute."""
+    with LOCK:
+        flight = IN_FLIGHT.get(key)
+        leader = flight is None
+        if leader:
+            flight = IN_FLIGHT[key] = Flight()
+    if leader:
+        try:
+            flight.result = compute()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with LOCK:
+                del IN_FLIGHT[key]
+            flight.done.set()
+    else:
+        flight.done.wait()
+        if flight.error:
+            raise flight.error
+    return flight.result
+
+
+@metrics.timed_request(slow_threshold=int(CONFIG.server.slow_request_ms) / 1000)
+def page_for(env) -> Response:
     """API entry point. Wait for CGI environnement.
 
-    Returns the html string to show to end-user.
+    Returns the Response to send to end-user.
 
     """
     # parse env and get static data
-    global PAGES, RENDERING
-    parameters = uri_parameters(env['REQUEST_URI'])
-    parameter = parameters[0] if len(parameters) > 0 else '1'
+    with metrics.span('parse_uri'):
+        parameters = uri_parameters(env['REQUEST_URI'])
+        parameter = parameters[0] if len(parameters) > 0 else '1'
 
-    global UNIQID
     if parameter == 'cache':
-        return RENDERING.html_repr() + '<hr>' + PAGES.html_repr()
+        with LOCK:
+            return uncached(RENDERING.html_repr() + '<hr>' + PAGES.html_repr())
+    if parameter == 'metrics':
+        with LOCK:
+            return uncached(metrics.prometheus(caches()), content_type=metrics.CONTENT_TYPE)
 
     if parameter == 'stack':
         for _ in range(int(parameters[1]) if len(parameters) > 1 else 1):
-            UNIQID += 1
-            DB.publish_later([Link(*([str(UNIQID)] * 4))])
-        return str(UNIQID)
+            DB.publish_later([Link(*([str(new_uniqid())] * 4))])
+        return uncached(str(UNIQID))
     if parameter == 'push':
         for _ in range(int(parameters[1]) if len(parameters) > 1 else 1):
-            UNIQID += 1
-            DB.publish([Link(*([str(UNIQID)] * 4))])
-        return str(UNIQID)
+            DB.publish([Link(*([str(new_uniqid())] * 4))])
+        return uncached(str(UNIQID))
     if parameter == 'move':
         DB.move_entry(int(parameters[1]) if len(parameters) > 1 else 1)
-        return str(UNIQID)
+        return uncached(str(UNIQID))
     if parameter == 'print':
-        return '\n<hr>\n'.join(map(str, DB.links))
+        return uncached('\n<hr>\n'.join(map(str, DB.links)))
+
+    archive_number = parameters[1] if len(parameters) > 1 else None
+    search_parameters = parameters[1:]
 
     # At this point, parameters are invalid: replace them with default.
     parameters = ()
 
     # create default data if none available
-    if DB.empty():
-        data_module.create_default_database(DB.name)
+    with metrics.span('empty'):
+        empty = DB.empty()
+    if empty:
+        data_module.create_default_database(DB.target)
 
     # move the next link if needed
     if CONFIG.autopublish.active:
-        DB.move_entry_if_expected()
+        publish_if_expected()
+
+    if parameter == 'archive':
+        return archive_for(archive_number, CONFIG, DB)
+    if parameter.startswith('feed.'):
+        return feed_for(parameter[len('feed.'):], CONFIG, DB)
+    if parameter == 'search':
+        return search_for(*search_parameters[:2], config=CONFIG, db=DB)
+    if parameter == 'tag':
+        return tag_for(*search_parameters[:2], config=CONFIG, db=DB)
 
     # other cases: parameter is the page number
     try:
@@ -74,60 +166,318 @@ def page_for(env) -> str:
 
     # requesting for non-published links
     if page_number <= 0:
-        return '<img src="https://upload.wikimedia.org/wikipedia/commons/thumb/2/23/Back-to-the-future-logo.svg/2000px-Back-to-the-future-logo.svg.png" alt="back to the future">'
+        return uncached('<img src="https://upload.wikimedia.org/wikipedia/commons/thumb/2/23/Back-to-the-future-logo.svg/2000px-Back-to-the-future-logo.svg.png" alt="back to the future">')
 
     # cache invalidation if data changed
-    last_link_rendered = PAGES[1][0] if 1 in PAGES else None
-    if last_link_rendered and DB.out_of_date(last_link_rendered):
-        print('DB OUT OF DATE')
-        PAGES = SLFUCache(CONFIG.server.cache_size)
-        RENDERING = SLFUCache(CONFIG.server.cache_size)
+    with metrics.span('out_of_date'):
+        with LOCK:
+            rendered = next(iter(RENDERING.values()), None)
+        if rendered and DB.out_of_date(rendered.generation):
+            with LOCK:
+                print('DB OUT OF DATE')
+                metrics.count('invalidations')
+                if config_module.boolean(CONFIG.server.stale_while_revalidate):
+                    STALE.clear()
+                    STALE.update(RENDERING.items())
+                PAGES.invalidate()
+                RENDERING.invalidate()
 
     # render the page, or get a redirection to the base site
-    render_page(page_number, CONFIG, DB)
-    html = RENDERING.get(page_number, redirection(CONFIG))
+    response = rendered_page(page_number, CONFIG, DB) or uncached(redirection(CONFIG))
 
     # handle the no-cache option
     if int(CONFIG.server.cache_size) <= 0:
-        PAGES = SLFUCache(CONFIG.server.cache_size)
-        RENDERING = SLFUCache(CONFIG.server.cache_size)
+        with LOCK:
+            PAGES.invalidate()
+            RENDERING.invalidate()
+
+    # send the response to end-user
+    return response
+
+
+def publish_if_expected():
+    """Move links by autopublish if expected, the pages cached
+    when the move began being given meanwhile by stale_response.
+
+    Threads finding another one moving links do not wait for it.
+
+    """
+    global PUBLISHING
+    with metrics.span('autopublish'):
+        if not DB._move_expected():  # usual case: nothing to do
+            return
+        if not PUBLISHER.acquire(blocking=False):
+            return
+        try:
+            with LOCK:
+                PUBLISHING = dict(RENDERING.items())
+            DB.move_entry_if_expected()
+        finally:
+            PUBLISHING = None
+            PUBLISHER.release()
+
+
+def new_uniqid() -> int:
+    """Return a new identifier for the links added by debug requests"""
+    global UNIQID
+    with LOCK:
+        UNIQID += 1
+        return UNIQID
+
+
+def stale_response(env) -> Response or None:
+    """Return the cached response of the requested page, without any check,
+    if autopublish is moving links. Return None otherwise,
+    or if the page is not in cache.
+
+    Takes no lock: meant to be called from an event loop.
+
+    """
+    cached = PUBLISHING
+    if cached is None:
+        return None
+    parameters = uri_parameters(env['REQUEST_URI'])
+    try:
+        page_number = int(parameters[0]) if parameters else 1
+    except ValueError:  # not a page
+        return None
+    return cached.get(page_number) or STALE.get(page_number)
 
-    # send the html to end-user
-    return html
+
+def rendered_page(nb:int, config, db) -> Response or None:
+    """Return the response of page nb, or None if it doesn't exist.
+
+    A page is rendered by only one thread at a time: the others wait for it,
+    or get the response of the page before invalidation,
+    if server.stale_while_revalidate is set.
+    A cached response is given only if rendered from the current generation.
+
+    """
+    generation = db.generation()  # memoized: costs at most a stat
+    with LOCK:
+        response = RENDERING.get(nb)
+        if response and response.generation == generation:
+            return response
+        if nb in STALE and ('page', nb) in IN_FLIGHT:
+            return STALE[nb]
+    return single_flight(('page', nb), lambda: render_page(nb, config, db))
 
 
 def create_page(nb:int, config, db):
-    """Create pages from first to nb. Populate PAGES."""
-    global PAGES
+    """Create page nb, if it exists. Populate PAGES.
+
+    Page nb exists if it is the first one, or if the previous pages
+    are all full. Links of previous pages are not read.
+
+    """
     assert nb > 0
-    if nb in PAGES: return  # no page need to be created
+    with LOCK:
+        if PAGES.get(nb) is not None: return  # no page need to be created
 
     nb_link_per_page = int(config.html.link_per_page)
-    links = iter(db.links)
-    next_links = lambda: islice(links, 0, nb_link_per_page)
-
-    for page_number in range(1, nb + 1):
-        if page_number in PAGES:  # page already generated
-            nb_link = sum(1 for link in next_links())
-        else:  # page not generated
-            all_link = tuple(next_links())
-            nb_link = len(all_link)
-            PAGES[page_number] = all_link
-        if nb_link < nb_link_per_page:
-            return  # not enough links to feed the next page
+    with metrics.span('create_page'):
+        links = db.page(nb, nb_link_per_page)
+        exists = links or nb == 1 or db.nb_link() == (nb - 1) * nb_link_per_page
+    if exists:
+        with LOCK:
+            PAGES[nb] = links
 
 
-def render_page(nb:int, config, db):
+def render_page(nb:int, config, db) -> Response or None:
     """Compute the html version of given page, populating RENDERING.
+    Return the response, or None if the page do not exists.
 
     If the page do not exists, it will create it first with create_page function.
+    The page is not cached if the database changed while it was rendered.
 
     """
-    if nb in RENDERING: return  # already rendered
+    generation = db.generation()  # before reading: the links may be newer
+    with LOCK:
+        response = RENDERING.peek(nb)  # already counted by rendered_page
+        if response and response.generation == generation:
+            return response  # already rendered
+        if response:  # rendered from a previous generation, as its links
+            PAGES.pop(nb, None)
     create_page(nb, config, db)
-    if nb not in PAGES: return  # not created because too few links
+    with LOCK:
+        links = PAGES.peek(nb)  # already counted by create_page
+    if links is None: return  # not created because too few links
     # the page exists, so the rendering is possible
-    RENDERING[nb] = template.render_full_page(config, nb, PAGES[nb], db)
+    response = Response(
+        template.render_full_page(config, nb, links, db),
+        last_modified=db.last_modified(),
+        cache_control=config.server.cache_control,
+        generation=generation
+    ).compressed()  # before caching: the size of an entry is computed once
+    changed = db.generation() != generation  # links may be older than an invalidation
+    with LOCK:
+        if changed:
+            PAGES.pop(nb, None)
+        else:
+            RENDERING[nb] = response
+            STALE.pop(nb, None)
+    return response
+
+
+def archive_for(parameter:str or None, config, db) -> Response:
+    """Return the response for given archive page, or the newest one if None.
+
+    Archive pages that may have changed since last call are removed
+    from cache: the ones from the previously newest if links were only
+    published, all of them if the database was changed otherwise.
+
+    """
+    global ARCHIVED
+    nb_link_per_page = int(config.html.link_per_page)
+    state = db.publication_state()
+    nb_link = state[1]
+    with LOCK:
+        previous = ARCHIVED
+    if state != previous:
+        published = db.published_since(previous)
+        first_changed = 1 if published is None else previous[1] // nb_link_per_page + 1
+        with LOCK:
+            for number in tuple(ARCHIVES):
+                if number >= first_changed:
+                    ARCHIVES.pop(number, None)
+            ARCHIVED = state
+    last_page = max(1, -(-nb_link // nb_link_per_page))
+    try:
+        page_number = int(parameter) if parameter else last_page
+    except ValueError:
+        page_number = last_page
+    if not 1 <= page_number <= last_page:
+        return uncached(redirection(config))
+
+    def render() -> str:
+        links = db.archive_page(page_number, nb_link_per_page)
+        return template.render_full_page(
+            config, page_number, links, db, prefix='/archive',
+            subtitle_text=template.SUBTITLE_MARK
+        )
+    with LOCK:
+        archived = ARCHIVES.get(page_number)
+    if archived:
+        rendering, response = archived
+    else:
+        rendering, response = single_flight(('archive', page_number), render), None
+    # the subtitle may have changed since the response was built
+    html = rendering.replace(template.SUBTITLE_MARK, template.subtitle(config, db))
+    if response is None or response.html != html:
+        response = Response(html, last_modified=db.last_modified(),
+                            cache_control=config.server.cache_control).compressed()
+        with LOCK:
+            ARCHIVES[page_number] = rendering, response
+    return response
+
+
+def search_for(query:str='', parameter:str=None, *, config, db) -> Response:
+    """Return the response for given page of the links matching
+    given query, as found in the URI"""
+    query = unquote_plus(query.split('?')[0])
+    try:
+        page_number = int(parameter) if parameter else 1
+    except ValueError:
+        page_number = 1
+    nb_link_per_page = int(config.html.link_per_page)
+    links = db.search(query, page_number, nb_link_per_page)
+    if page_number < 1 or not links and page_number > 1:
+        return uncached(redirection(config))
+    html = template.render_full_page(config, page_number, links, db,
+                                     prefix='/search/' + quote(query))
+    return Response(html, last_modified=db.last_modified(),
+                    cache_control=config.server.cache_control,
+                    generation=db.generation())
+
+
+def invalidate_tags(db):
+    """Remove from TAGS the pages of the tags of links published
+    since last call, or all of them if the database was rewritten"""
+    global TAGGED
+    state = db.publication_state()
+    if TAGGED == state:
+        return
+    published = db.published_since(TAGGED)
+    changed = None  # tags of new links, or None for all tags
+    if published is not None:
+        changed = {tag.lower() for link in published for tag in link.tags}
+    with LOCK:
+        for key in tuple(TAGS):
+            if changed is None or key[0] in changed:
+                TAGS.pop(key, None)
+        TAGGED = state
+
+
+def tag_for(tag:str='', parameter:str=None, *, config, db) -> Response:
+    """Return the response for given page of the links having given tag"""
+    tag = unquote_plus(tag.split('?')[0]).lower()
+    try:
+        page_number = int(parameter) if parameter else 1
+    except ValueError:
+        page_number = 1
+    if page_number < 1:
+        return uncached(redirection(config))
+    invalidate_tags(db)
+
+    def render() -> str or None:
+        links = db.tagged(tag, page_number, int(config.html.link_per_page))
+        if not links and page_number > 1:
+            return None
+        return template.render_full_page(
+            config, page_number, links, db, prefix='/tag/' + quote(tag),
+            subtitle_text=template.SUBTITLE_MARK
+        )
+    with LOCK:
+        tagged = TAGS.get((tag, page_number))
+    if tagged:
+        rendering, response = tagged
+    else:
+        rendering, response = single_flight(('tag', tag, page_number), render), None
+    if rendering is None:  # no such page
+        return uncached(redirection(config))
+    # the subtitle may have changed since the response was built
+    html = rendering.replace(template.SUBTITLE_MARK, template.subtitle(config, db))
+    if response is None or response.html != html:
+        response = Response(html, last_modified=db.last_modified(),
+                            cache_control=config.server.cache_control).compressed()
+        with LOCK:
+            TAGS[tag, page_number] = rendering, response
+    return response
+
+
+def feed_for(kind:str, config, db) -> Response:
+    """Return the response for the feed of given kind (atom or rss),
+    built only if the database changed since last one"""
+    if kind not in feed.FORMATS:
+        return uncached(redirection(config))
+    generation = db.generation()
+    with LOCK:
+        response = FEEDS.get(kind)
+    if response and response.generation == generation:
+        return response
+
+    def build() -> Response:
+        links = tuple(itertools.islice(db.links, int(config.feed.size)))
+        response = Response(feed.FORMATS[kind](config, links),
+                            last_modified=db.last_modified(),
+                            cache_control=config.server.cache_control,
+                            generation=generation,
+                            content_type=feed.CONTENT_TYPES[kind]).compressed()
+        with LOCK:
+            FEEDS[kind] = response
+        return response
+    return single_flight(('feed', kind, generation), build)
+
+
+def uncached(html:str, **kwargs) -> Response:
+    """Return a response that must not be cached"""
+    return Response(html, cache_control=None, **kwargs)
+
+
+def caches() -> dict:
+    """Return the caches, by name"""
+    return {'pages': PAGES, 'rendering': RENDERING, 'archives': ARCHIVES,
+            'tags': TAGS, 'feeds': FEEDS, 'fragments': template.FRAGMENTS}
 
 
 def redirection(config) -> str:
@@ -1,15 +1,23 @@
 """Wrapper around the database handling, and around the database handler.
 
-Database would be stored in DSV using standard delimiter,
-so chances are you would never need to escape anything in your text.
-However, because of csv limitation on record separator (only \\n
-and \\r are valid, and synonymous), this perfect case can't be used.
-Solution: assume that fields are enclosed in double quotes.
+Database is stored in DSV using standard delimiter, or in a binary format
+read without parsing, as chosen by database.format (see records.py).
+It may also be a SQLite database (see storage.py).
 
-See https://en.wikipedia.org/wiki/Delimiter#ASCII_delimited_text
 
+Writers of a database hold its lock, an advisory lock (fcntl) on a sidecar
+file with the .lock extension, so that writers of all processes are
+serialized. Links added by threads while another one is writing
+are added all at once by the next writer (group commit).
 
-DatabaseHandler allow one to manipulate database itself.
+Writers never modify in place the records of a database: a rewritten
+database is built in a temporary file, which then replaces it atomically.
+Readers keep reading the version they opened, so they never wait
+for the writers, and never see a partially written database.
+Each change increases the generation of the database (see index.Generation).
+
+DatabaseHandler allow one to manipulate database itself, when stored in a file.
+Methods common to all handlers are defined by storage.StorageInterface.
 
 HandlerAggregator allow one to manage DatabaseHandler at very high level,
 and implements the autopublish funtionnality.
@@ -18,22 +26,31 @@ and implements the autopublish funtionnality.
 
 
 import os
-import csv
 import time
+import shutil
+import threading
 import itertools
-import functools
+import contextlib
+from array import array
 
-from shaarpli.commons import Link, file_content
+from shaarpli import config as config_module
+from shaarpli import export as export_module
+from shaarpli import records as records_module
+from shaarpli.search import SearchIndex
+from shaarpli.storage import SQLITE, SQLiteHandler, StorageInterface, EXTENSION as SQLITE_EXT
+from shaarpli.commons import Link
+from shaarpli.index import (OffsetIndex, HeadCursor, Generation, file_lock,
+                            scan_offsets, tempname)
+from shaarpli.records import DSV, RecordFormat
 
 
 MEMORY_WISE = True  # define the method used to add links into database
-DSV_FIELD_SEP = chr(31)
-DSV_RECORD_SEP = chr(30)
-CSV_PARAMS = {
-    'delimiter': DSV_FIELD_SEP,
-    # 'lineterminator': DSV_RECORD_SEP,  # NOT HANDLED BY PYTHON. NOT A JOKE. WTF PYTHON.
-    'lineterminator': '\n',
-}
+REVERSE_BLOCK = 64  # number of records read at once when reading backward
+FORWARD_BLOCK = 256  # number of offsets read at once when reading forward
+REWRITE_BLOCK = 1024  # number of links encoded at once when rewriting
+EXTENSIONS = {**records_module.EXTENSIONS, SQLITE: SQLITE_EXT}  # database.format -> usual extension
+COMMITS = {}  # database -> GroupCommit
+COMMITS_GUARD = threading.Lock()
 TIME_EQUIVALENCE = {  # terms available for autopublish.every
     'minute': 60,
     'hour': 60*60,
@@ -43,13 +60,73 @@ TIME_EQUIVALENCE = {  # terms available for autopublish.every
 }
 
 
+class GroupCommit:
+    """Writes of links in a database, by a single writer at a time.
+
+    Links submitted while another thread is writing are queued.
+    Once the lock is released, the next writer adds all the queued links
+    with a single call to the extend function.
+
+    """
+
+    def __init__(self, database:str, extend_func:callable, record_format:RecordFormat=DSV):
+        self.database = database
+        self.extend_func = extend_func
+        self.record_format = record_format
+        self.newest_first = extend_func is not extend_append
+        self.pending = []  # [links, done event, error]
+        self.guard = threading.Lock()
+
+    def submit(self, links:tuple):
+        """Add given links to the database, once they and the queued ones
+        can be written"""
+        entry = [links, threading.Event(), None]
+        with self.guard:
+            self.pending.append(entry)
+        with file_lock(self.database):
+            if not entry[1].is_set():  # not written by another thread
+                with self.guard:
+                    batch, self.pending = self.pending, []
+                # links of later submissions are the newest
+                submissions = reversed(batch) if self.newest_first else batch
+                links = tuple(link for submitted in submissions for link in submitted[0])
+                try:
+                    self.extend_func(links, database=self.database, record_format=self.record_format)
+                    Generation(self.database).increment()
+                except Exception as error:
+                    for submitted in batch:
+                        submitted[2] = error
+                    raise
+                finally:
+                    for submitted in batch:
+                        submitted[1].set()
+        if entry[2] is not None:
+            raise entry[2]
+
+
+def group_commit(database:str, extend_func:callable,
+                 record_format:RecordFormat=DSV) -> GroupCommit:
+    """Return the GroupCommit of given database, shared by all handlers"""
+    key = os.path.abspath(database), extend_func, record_format
+    with COMMITS_GUARD:
+        if key not in COMMITS:
+            COMMITS[key] = GroupCommit(database, extend_func, record_format)
+        return COMMITS[key]
+
+
 def add(link:Link, database:str):
     """Prepend given entry (title, desc, url) to given file"""
     lines = link,
     extend(lines, database=database)
 
 
-def extend_memwise(links:iter, database:str):
+def encode_links(links:iter, record_format:RecordFormat=DSV) -> (bytes, array):
+    """Return the encoding of given Link instances in given format,
+    and the offset of each record in it"""
+    return record_format.encode(link.to_dsv() for link in links)
+
+
+def extend_memwise(links:iter, database:str, record_format:RecordFormat=DSV):
     """Prepend Link instances to given file
 
     This implementation is memory-wise : it uses an intermediate file to avoid
@@ -57,20 +134,17 @@ def extend_memwise(links:iter, database:str):
     (so it is, consequently, potentially slow)
 
     """
-    db_bak = database + '.bak'  # intermediate file containing previous entries
-    os.rename(database, db_bak)
-    # write new data in newly created file
-    with open(database, 'w') as fd:
-        writer = csv.writer(fd, **CSV_PARAMS)
-        for link in links:
-            writer.writerow([*link])
-        with open(db_bak) as prev_entries:
-            reader = csv.reader(prev_entries, **CSV_PARAMS)
-            for entry in reader:
-                writer.writerow(entry)
-    os.remove(db_bak)
-
-def extend_timewise(links:iter, database:str):
+    index = OffsetIndex(database, record_format)
+    index.refresh()
+    block, offsets = encode_links(links, record_format)
+    new_db = tempname(database)  # the new version, replacing the database once written
+    with open(new_db, 'wb') as fd:
+        fd.write(block)
+        with open(database, 'rb') as prev_entries:
+            shutil.copyfileobj(prev_entries, fd)
+    index.prepended(offsets, len(block), new_db)
+
+def extend_timewise(links:iter, database:str, record_format:RecordFormat=DSV):
     """Prepend Link instances to given file
 
     This implementation is time-wise : it loads the full file in memory
@@ -78,15 +152,18 @@ def extend_timewise(links:iter, database:str):
     (so it is, consequently, potentially hard on memory)
 
     """
-    with open(database) as fd:
+    index = OffsetIndex(database, record_format)
+    index.refresh()
+    block, offsets = encode_links(links, record_format)
+    with open(database, 'rb') as fd:
         prev_entries = fd.read()
-    with open(database, 'w') as fd:
-        writer = csv.writer(fd, **CSV_PARAMS)
-        for link in links:
-            writer.writerow([*link])
+    new_db = tempname(database)
+    with open(new_db, 'wb') as fd:
+        fd.write(block)
         fd.write(prev_entries)
+    index.prepended(offsets, len(block), new_db)
 
-def extend_append(links:iter, database:str):
+def extend_append(links:iter, database:str, record_format:RecordFormat=DSV):
     """Append Link instances to given file
 
     This implementation simply push the data at the end of the file.
@@ -94,77 +171,210 @@ def extend_append(links:iter, database:str):
     to be the last link on the last page.
 
     """
-    with open(database, 'a') as fd:
-        writer = csv.writer(fd, **CSV_PARAMS)
-        for link in links:
-            writer.writerow([*link])
+    index = OffsetIndex(database, record_format)
+    index.refresh()
+    block, offsets = encode_links(links, record_format)
+    with open(database, 'ab') as fd:
+        start = fd.tell()
+        fd.write(block)
+    index.appended(offsets, start)
+
+def extend_newest_last(links:iter, database:str, record_format:RecordFormat=DSV):
+    """Add Link instances, given newest first, at the end of given file
+
+    This implementation is for databases storing the newest link last
+    (see the append_only option): the previous data is never rewritten.
+
+    """
+    extend_append(reversed(tuple(links)), database, record_format)
 
 # this choice should be made through a config file parameter
 extend = extend_memwise if MEMORY_WISE else extend_timewise
 
 
-def create_default_database(database:str):
-    """Add default database : some example links for new users"""
-    extend((
-        ('second link', 'is also the last\n in database', 'http://github.com/aluriak/shaarpli', time.time()),
-        ('first link', 'is also the first  \n in database\n\n- a\n- b\n- c', 'http://github.com/aluriak/shaarpli', time.time() - 25*3600),
-    ), database=database)
+def create_default_database(handler):
+    """Add default database : some example links for new users.
+
+    The emptiness is checked again with the lock held, so that only one
+    of the threads and processes finding the database empty fills it.
+
+    """
+    with file_lock(handler.name):
+        handler._changed()  # may have been filled by another process
+        if not handler.empty():
+            return
+        handler.extend((
+            Link('second link', 'is also the last\n in database', 'http://github.com/aluriak/shaarpli', time.time()),
+            Link('first link', 'is also the first  \n in database\n\n- a\n- b\n- c', 'http://github.com/aluriak/shaarpli', time.time() - 25*3600),
+        ))
 
 
-class DatabaseHandler:
-    """Access to database.
+def reverse_database(database:str, record_format:RecordFormat=DSV):
+    """Reverse the order of links in given database.
+
+    Allow to convert a database storing the newest link first
+    into one storing it last, as expected by the append_only option,
+    and the other way around.
+
+    """
+    handler = DatabaseHandler(database, record_format=record_format)
+    with file_lock(database):
+        reversed_db = tempname(database)
+        with open(reversed_db, 'wb') as fd:
+            rows = handler._rows_backward(0)
+            while True:
+                block = tuple(itertools.islice(rows, REVERSE_BLOCK))
+                if not block:
+                    break
+                fd.write(record_format.encode(block)[0])
+        handler.index.replace_database(reversed_db, scan_offsets(reversed_db, record_format)[1])
+        Generation(database).increment()
+
+
+class DatabaseHandler(StorageInterface):
+    """Access to database stored in a file.
 
     Provides high-level methods allowing to probe database state,
     and to add data.
 
     Is also iterable over the data as 3-uplet (title, description, link).
 
+    If newest_last is set, links are stored in the file from the oldest
+    to the newest, and are iterated backward, block by block.
+    This is the storage used with the append_only option.
+
+    If queue is set, the database begins at its head cursor,
+    and links can be removed from the beginning with dequeue.
+
+    Links are read from a snapshot of the database (see OffsetIndex.snapshot),
+    unaffected by the writes happening while they are read.
+    Records are encoded in given format (see records.py).
+
+    See StorageInterface for the memoization of the state of the database.
+
     """
 
-    def __init__(self, filename:str, extend_func:callable=extend) -> iter:
-        self.name = filename
+    def __init__(self, filename:str, extend_func:callable=extend,
+                 newest_last:bool=False, queue:bool=False,
+                 check_delay:float=0., record_format:RecordFormat=DSV) -> iter:
+        super().__init__(filename, check_delay)
+        self.newest_last = bool(newest_last)
+        self.queue = bool(queue)
         assert self.exists()
         self.last_access_time = time.time()
-        self.extend = functools.partial(extend_func, database=self.name)
+        self.record_format = record_format
+        self._commits = group_commit(self.name, extend_func, record_format)
+        self.index = OffsetIndex(self.name, record_format)
+        self.head = HeadCursor(self.name) if queue else None
 
 
-    @property
-    def links(self):
-        return iter(self)
+    def extend(self, links:iter):
+        """Add given Link instances to the database, holding its lock"""
+        self._commits.submit(tuple(links))
+        self._changed()
 
     def nb_link(self) -> int:
         """Returns the number of link in the database.
 
-        It will come accross the full database, so it's not a good
-        idea to use this method on a regular basis.
-        (or on a big database)
+        The count is kept up to date by the writers, and is valid as long
+        as the files do not change.
+        Otherwise, it is given by the index, built if necessary.
 
         """
-        return sum(1 for link in self.links)
+        def count():
+            self.index.refresh()
+            return len(self.index) - self._first_record()
+        return self._memoized('nb_link', count)
 
-    @property
-    def last_link(self) -> Link or None:
-        """Return the last published link in database, or None if no link
-        in database."""
-        try:
-            return next(iter(self))
-        except StopIteration:
-            return None
+    def files(self) -> tuple:
+        """The database, and its head cursor"""
+        return (self.name, self.head.name) if self.head else (self.name,)
+
+    def links_from(self, nb:int) -> iter:
+        """Yield links of the database, from the newest (oldest for a queue),
+        starting at the *nb*-th (from 0).
 
+        Preceding links are not read: the index gives where to start.
 
-    def __iter__(self):
+        """
         self.last_access_time = time.time()
-        with open(self.name) as fd:
-            reader = csv.reader(fd, **CSV_PARAMS)
-            for idx, line in enumerate(reader, start=1):
-                try:
-                    yield Link.from_dsv(line)
-                except ValueError as e:  # unpack
-                    print('ValueError:', e)
-                    print(line)
-                    print('This line will be ignored.')
-                    continue
+        self.index.refresh()
+        return self._links(self._rows_backward(nb) if self.newest_last else self._rows_forward(nb))
+
+    def links_oldest_first(self) -> iter:
+        self.index.refresh()
+        forward = self.newest_last or self.queue  # links are stored from the oldest
+        return self._links(self._rows_forward(0) if forward else self._rows_backward(0))
+
+    def _links(self, rows:iter) -> iter:
+        """Yield the links of given records, all valid since indexed
+        (see index.scan_offsets)"""
+        return map(Link.from_record, rows)
+
+    def _first_record(self) -> int:
+        """Number of the record being the first link (not 0 for a queue)"""
+        return self.head.get(self.index)[1] if self.head else 0
+
+    def _rows_forward(self, nb:int) -> iter:
+        """Yield the raw records in file order, starting at the *nb*-th.
 
+        Records are read at the offsets given by the index,
+        read by blocks of FORWARD_BLOCK.
+
+        """
+        fd, index = self.index.snapshot()
+        if fd is None:  # no database
+            return
+        with fd, contextlib.closing(index), self.record_format.mapped(fd) as source:
+            start = (self.head.get(index)[1] if self.head else 0) + nb
+            while True:
+                offsets = index.offsets(start, start + FORWARD_BLOCK + 1)
+                if not offsets:  # no more links
+                    return
+                # block end is next record, or end of file
+                end = offsets[-1] if len(offsets) > FORWARD_BLOCK else None
+                yield from self.record_format.rows(source, offsets[:FORWARD_BLOCK], end)
+                start += FORWARD_BLOCK
+
+    def _rows_backward(self, nb:int) -> iter:
+        """Yield the raw records in reversed file order, starting at the
+        *nb*-th from the end of file.
+
+        The file is read by blocks of REVERSE_BLOCK records,
+        each one being read forward and then yielded in reversed order.
+
+        """
+        fd, index = self.index.snapshot()
+        if fd is None:  # no database
+            return
+        with fd, contextlib.closing(index), self.record_format.mapped(fd) as source:
+            stop = len(index) - nb
+            while stop > 0:
+                start = max(0, stop - REVERSE_BLOCK)
+                offsets = index.offsets(start, stop + 1)
+                # block end is next record, or end of file
+                end = offsets[-1] if len(offsets) > stop - start else None
+                block = self.record_format.rows(source, offsets[:stop - start], end)
+                yield from reversed(list(block))
+                stop = start
+
+    def links_by_id(self, ids:iter) -> iter:
+        """Yield the links of given ids, the id of a link being the number
+        of links published before it (see search.py).
+        Ids of links not in database are ignored."""
+        fd, index = self.index.snapshot()
+        if fd is None:  # no database
+            return
+        with fd, contextlib.closing(index), self.record_format.mapped(fd) as source:
+            first_record = self.head.get(index)[1] if self.head else 0
+            nb_link = len(index) - first_record
+            for id in ids:
+                if not 0 <= id < nb_link:
+                    continue
+                record = id if self.newest_last or self.queue else nb_link - 1 - id
+                line = self.record_format.row_at(source, index.offset(first_record + record))
+                if line is not None:
+                    yield from self._links((line,))
 
     def exists(self) -> bool:
         """True if databate contains something"""
@@ -175,17 +385,108 @@ class DatabaseHandler:
         except FileNotFoundError:
             return False
 
-    def empty(self) -> bool:
-        """True if databate contains nothing"""
-        return not self.exists() or not open(self.name).read().strip()
+    def dequeue(self, nb:int, compaction_threshold:int):
+        """Remove the *nb* first links from the queue by moving its head cursor.
 
-    def out_of_date(self, last_link_rendered:Link) -> bool:
-        """True if database have changed since last link"""
-        link_change_time = last_link_rendered.publication_date
-        file_change_time = int(os.path.getmtime(self.name))
-        assert isinstance(file_change_time, int)
-        assert isinstance(link_change_time, int)
-        return link_change_time < file_change_time  # link is older
+        The file itself is rewritten without the removed links (compacted)
+        only once the removed part is larger than given threshold, in bytes.
+
+        """
+        assert self.head, "DatabaseHandler must be a queue to dequeue links"
+        with file_lock(self.name):
+            self.index.refresh()
+            _, record = self.head.get(self.index)
+            record = min(record + nb, len(self.index))
+            offset = self.index.offset(record)
+            if offset is None:  # all links are removed
+                offset = os.path.getsize(self.name)
+            self.head.set(offset, record, self.index)
+            self.generation_file.increment()
+            if offset >= compaction_threshold:
+                self.compact()
+            self._changed(nb_link=len(self.index) - self.head.get(self.index)[1])
+
+    def compact(self):
+        """Rewrite the queue without the links before its head cursor"""
+        assert self.head, "DatabaseHandler must be a queue to be compacted"
+        with file_lock(self.name):
+            self.index.refresh()
+            start, record = self.head.get(self.index)
+            # write new data in a new version, ignoring the links before head
+            new_db = tempname(self.name)
+            with open(new_db, 'wb') as fd, open(self.name, 'rb') as prev_entries:
+                prev_entries.seek(start)
+                shutil.copyfileobj(prev_entries, fd)
+            self.index.dropped(record, new_db)
+            self.head.set(0, 0, self.index)
+            self.generation_file.increment()
+            self._changed()
+
+    def rewrite(self, links:iter) -> int:
+        """Replace all links of the database by given ones, in file order.
+
+        The new database and its index are written in a single pass,
+        REWRITE_BLOCK links at a time, then replace the database.
+        Links may be read from the database meanwhile.
+
+        """
+        links = iter(links)
+        with file_lock(self.name):
+            new_db, offsets = tempname(self.name), array('Q')
+            with open(new_db, 'wb') as fd:
+                while True:
+                    block = tuple(itertools.islice(links, REWRITE_BLOCK))
+                    if not block:
+                        break
+                    encoded, block_offsets = encode_links(block, self.record_format)
+                    start = fd.tell()
+                    offsets.extend(offset + start for offset in block_offsets)
+                    fd.write(encoded)
+            self.index.replace_database(new_db, offsets)
+            if self.head:
+                self.head.set(0, 0, self.index)
+            self.generation_file.increment()
+        self._changed(nb_link=len(offsets))
+        return len(offsets)
+
+    def generation(self) -> int:
+        """Return the generation of the database, increased at each change.
+
+        A database modified by a writer unaware of generations
+        is detected, and gets a new generation.
+
+        """
+        def generation():
+            self.index.refresh()
+            return self.generation_file.get()
+        return self._memoized('generation', generation)
+
+
+def new_handler(config, filename:str, queue:bool=False,
+                database_format:str=None) -> StorageInterface:
+    """Return a new handler of given database according to given configuration.
+
+    queue -- the database is the queue of links to publish
+    database_format -- by default, database.format
+
+    """
+    database_format = database_format or config.database.format
+    check_delay = int(config.database.check_delay_ms) / 1000
+    if database_format == SQLITE:
+        return SQLiteHandler(filename, queue=queue, check_delay=check_delay)
+    record_format = records_module.get(database_format)
+    if queue:
+        return DatabaseHandler(filename, extend_func=extend_append, queue=True,
+                               check_delay=check_delay, record_format=record_format)
+    if config_module.boolean(config.database.append_only):
+        return DatabaseHandler(filename, extend_func=extend_newest_last, newest_last=True,
+                               check_delay=check_delay, record_format=record_format)
+    return DatabaseHandler(
+        filename,
+        extend_func=extend_memwise if config.database.memory_wise else extend_timewise,
+        check_delay=check_delay,
+        record_format=record_format
+    )
 
 
 class HandlerAggregator:
@@ -202,6 +503,9 @@ class HandlerAggregator:
     - detect, according to configuration, if a move must be performed
     - behave like the target DatabaseHandler, with consideration of the source if any
     - allow publishing (add to target) and publishing later (add to source)
+    - keep the search index of target up to date
+    - export the site as static files after each change, if configured,
+      in a thread (see export.BackgroundExport)
 
     """
 
@@ -209,22 +513,18 @@ class HandlerAggregator:
         self._config = config
         self.source = None
         self.target_file = config.database.filepath
-        self.target = DatabaseHandler(
-            self.target_file,
-            extend_func=extend_memwise if config.database.memory_wise else extend_timewise
-        )
+        self.target = new_handler(config, self.target_file)
+        self.search_index = SearchIndex(self.target)
+        self._exports = export_module.BackgroundExport(config, self)
         if config.autopublish.active:
             self.source_file = config.autopublish.filepath
-            self.source = DatabaseHandler(
-                self.source_file,
-                extend_func=extend_append
-            )
+            self.source = new_handler(config, self.source_file, queue=True)
 
 
     @property
     def hassource(self) -> bool: return bool(self.source)
     @property
-    def handler(self) -> DatabaseHandler: return self.target
+    def handler(self) -> StorageInterface: return self.target
 
     def _move_expected(self) -> bool:
         """True iff an entry move is needed, according to configuration"""
@@ -262,14 +562,17 @@ class HandlerAggregator:
         #  of age. While the target database is in decreasing order of age
         #  (most recent first).
         #  Therefore, the extracted entries must be inserted in reverse order.
-        entries = tuple(reversed(tuple(itertools.islice(self.source, 0, nb))))
-        nb_link_moved = len(entries)
+        with file_lock(self.target.name), file_lock(self.source.name):
+            entries = tuple(reversed(tuple(itertools.islice(self.source, 0, nb))))
+            nb_link_moved = len(entries)
+            if nb_link_moved > 0:
+                self.publish(entries, export=False)
+                self._clean_source(nb)
         if nb_link_moved > 0:
-            self.publish(entries)
-            self._clean_source(nb)
+            self.export_later()
         return nb_link_moved
 
-    def publish(self, links:iter):
+    def publish(self, links:iter, *, export:bool=True):
         """Add given Link instances to the database (target handler)
         in given order.
 
@@ -280,6 +583,9 @@ class HandlerAggregator:
         for link in links:
             link.publish()
         self.target.extend(links)
+        self.search_index.update()
+        if export:
+            self.export_later()
 
     def publish_later(self, links:iter):
         """Add given Link instances to the unpublished database (source handler)
@@ -287,34 +593,43 @@ class HandlerAggregator:
 
         """
         self.source.extend(links)
+        self.export_later()
+
+    def export(self):
+        """Write the static site in export.directory, if any"""
+        if self._config.export.directory:
+            export_module.export_site(self._config, self)
+
+    def export_later(self):
+        """Write the static site in export.directory, if any,
+        in a thread, without waiting for it"""
+        if self._config.export.directory:
+            self._exports.request()
 
     def _clean_source(self, nb:int):
         """Remove the *nb* first entries from source database.
 
-        Calling this method at each entry move can be costly.
-        A system of offset on source was once implemented, but since
-        the offset value was not saved between two runs of the codebase,
-        it just leads to bugs.
+        The head cursor of source is moved, and saved between two runs
+        of the codebase. The source file is rewritten only when the removed
+        entries weight more than autopublish.compaction_threshold bytes.
 
         """
-        database = self.source.name
-        db_bak = database + '.bak'  # intermediate file containing previous entries
-        os.rename(database, db_bak)
-        # write new data in newly created file
-        with open(database, 'w') as fd, open(db_bak) as prev_entries:
-            writer = csv.writer(fd, **CSV_PARAMS)
-            reader = csv.reader(prev_entries, **CSV_PARAMS)
-            # ignore the first *nb* links
-            for entry in itertools.islice(reader, nb, None):
-                writer.writerow([*entry])
-        os.remove(db_bak)
+        self.source.dequeue(nb, int(self._config.autopublish.compaction_threshold))
 
 
     def move_entry_if_expected(self):
         """If a move is expected according to configuration, then perform
-        the move"""
+        the move.
+
+        The expectation is checked again with the lock held,
+        so that only one of the processes expecting a move performs it.
+
+        """
         if self._move_expected():
-            self.move_entry(nb=int(self._config.autopublish.link_per_publication))
+            with file_lock(self.target.name):
+                self.target._changed()  # last link may have been moved by another process
+                if self._move_expected():
+                    self.move_entry(nb=int(self._config.autopublish.link_per_publication))
 
 
     # Follows functions allowing HandlerAggregator to behave
@@ -324,9 +639,25 @@ class HandlerAggregator:
         """True if both source and target are empty"""
         return self.target.empty() and (not self.source or self.source.empty())
 
-    def out_of_date(self, last_link_rendered:Link) -> bool:
+    def out_of_date(self, generation:int) -> bool:
+        """Proxy of target DatabaseHandler"""
+        return self.target.out_of_date(generation)
+
+    def generation(self) -> int:
+        """Proxy of target DatabaseHandler"""
+        return self.target.generation()
+
+    def publication_state(self) -> list:
         """Proxy of target DatabaseHandler"""
-        return self.target.out_of_date(last_link_rendered)
+        return self.target.publication_state()
+
+    def published_since(self, state:list or None) -> tuple or None:
+        """Proxy of target DatabaseHandler"""
+        return self.target.published_since(state)
+
+    def last_modified(self) -> float or None:
+        """Proxy of target DatabaseHandler"""
+        return self.target.last_modified()
 
     @property
     def name(self) -> str:
@@ -338,16 +669,42 @@ class HandlerAggregator:
         """Proxy of target DatabaseHandler"""
         return self.target.links
 
+    def links_from(self, nb:int) -> iter:
+        """Proxy of target DatabaseHandler"""
+        return self.target.links_from(nb)
+
+    def page(self, nb:int, size:int) -> tuple:
+        """Proxy of target DatabaseHandler"""
+        return self.target.page(nb, size)
+
+    def archive_page(self, nb:int, size:int) -> tuple:
+        """Proxy of target DatabaseHandler"""
+        return self.target.archive_page(nb, size)
+
     @property
     def last_link(self) -> Link or None:
         """Return the last published link in target database, or None if no link
         in database."""
         return self.target.last_link
 
+    def nb_link(self) -> int:
+        """Proxy of target DatabaseHandler"""
+        return self.target.nb_link()
+
+    def search(self, query:str, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1) of the links
+        of target containing all words of given query"""
+        return self.search_index.page(query, nb, size)
+
+    def tagged(self, tag:str, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1) of the links
+        of target having given tag"""
+        return self.search_index.tag_page(tag, nb, size)
+
     def nb_unpublished_links(self) -> int:
         """Return the number of links in source database.
 
-        Will read the full source database.
+        Costs a stat of source files, unless they changed.
 
         """
         return self.source.nb_link()
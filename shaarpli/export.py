@@ -0,0 +1,181 @@
+"""Export of the site as static files, to be served without python.
+
+Each page is written in <directory>/<N>/index.html, and each archive page
+in <directory>/archive/<N>/index.html. The first page is also written
+in <directory>/index.html, and the newest archive page
+in <directory>/archive/index.html.
+
+The subtitle, changing at each publication, is written in <directory>/subtitle.html
+only, and included by the pages with a Server Side Include directive
+(like `ssi on;` for nginx), so that pages do not change with it.
+The directive gives the path of server.url: the site is expected
+to be served there.
+
+A manifest keeps the hash of each written file, so that an export only
+writes the files whose content changed. Files are written atomically,
+and an export holds the lock of the manifest, so that exports of several
+processes are serialized. Full archive pages only change when the database
+is rewritten (see StorageInterface.published_since): otherwise,
+they are not even rendered again.
+
+BackgroundExport runs the exports in a thread, outside of the requests.
+
+"""
+
+
+import os
+import html
+import json
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+from shaarpli import template
+from shaarpli.index import file_lock, tempname
+
+
+MANIFEST = '.manifest.json'
+SUBTITLE = 'subtitle.html'  # included by the pages
+INCLUDE = '<!--#include virtual="{}/{}" -->'
+
+
+def site_path(url:str) -> str:
+    """Return the path of the site at given URL, without final slash,
+    as expected by a Server Side Include directive
+
+    >>> site_path('https://example.org/links/')
+    '/links'
+    >>> site_path('localhost')
+    ''
+    >>> site_path('/links')
+    '/links'
+
+    """
+    if '//' not in url and not url.startswith('/'):  # host without scheme
+        url = '//' + url
+    return urlsplit(url).path.rstrip('/')
+
+
+def write_atomic(filename:str, content:str):
+    """Write given content in given file, which is replaced only
+    once the content is fully written"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = tempname(filename)
+    with open(tmp, 'w') as fd:
+        fd.write(content)
+    os.replace(tmp, filename)
+
+
+def export_site(config, db, directory:str=None) -> int:
+    """Write the pages that changed since last export in given directory
+    (export.directory by default). Return the number of written files."""
+    directory = directory or config.export.directory
+    os.makedirs(directory, exist_ok=True)
+    with file_lock(os.path.join(directory, MANIFEST)):
+        return _export_site(config, db, directory)
+
+
+def _export_site(config, db, directory:str) -> int:
+    manifest_file = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_file) as fd:
+            manifest = json.load(fd)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    previous_files = manifest.get('files', {})  # relative path -> content hash
+    files = {}
+    nb_written = 0
+
+    def export(paths:tuple, content:str):
+        nonlocal nb_written
+        digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        for path in paths:
+            files[path] = digest
+            if previous_files.get(path) != digest or not os.path.exists(os.path.join(directory, path)):
+                write_atomic(os.path.join(directory, path), content)
+                nb_written += 1
+
+    nb_link_per_page = int(config.html.link_per_page)
+    state = db.publication_state()
+    nb_link = state[1]
+    include = INCLUDE.format(site_path(config.server.url), SUBTITLE)
+    export((SUBTITLE,), html.escape(template.subtitle(config, db)))
+
+    def render(page_number:int, links:tuple, prefix:str='') -> str:
+        return template.render_full_page(
+            config, page_number, links, db, prefix=prefix,
+            subtitle_text=template.SUBTITLE_MARK
+        ).replace(template.SUBTITLE_MARK, include)
+
+    # pages from the newest link: all of them change at each publication
+    last_page = nb_link // nb_link_per_page + 1
+    for page_number in range(1, last_page + 1):
+        paths = '{}/index.html'.format(page_number),
+        export(paths + (('index.html',) if page_number == 1 else ()),
+               render(page_number, db.page(page_number, nb_link_per_page)))
+
+    # pages from the oldest link: only the ones after the previous newest change,
+    #  unless the database was rewritten since previous export
+    last_archive = max(1, -(-nb_link // nb_link_per_page))
+    unchanged = 0
+    previous_state = manifest.get('state')
+    if manifest.get('include') == include and db.published_since(previous_state) is not None:
+        unchanged = previous_state[1] // nb_link_per_page  # full pages
+    for page_number in range(1, last_archive + 1):
+        paths = 'archive/{}/index.html'.format(page_number),
+        if page_number == last_archive:
+            paths += 'archive/index.html',
+        if page_number <= unchanged and all(path in previous_files for path in paths):
+            files.update({path: previous_files[path] for path in paths})
+            continue
+        export(paths, render(page_number, db.archive_page(page_number, nb_link_per_page),
+                             prefix='/archive'))
+
+    # pages that do not exist anymore
+    for path in set(previous_files) - set(files):
+        try:
+            os.remove(os.path.join(directory, path))
+        except FileNotFoundError:
+            pass
+
+    write_atomic(manifest_file, json.dumps({
+        'state': state, 'include': include, 'files': files
+    }))
+    return nb_written
+
+
+class BackgroundExport:
+    """Exports of a site performed by a thread, outside of the requests.
+
+    An export asked while another one is running is performed once
+    it is finished: several changes lead to a single export.
+    The thread is not a daemon, so that a script exits once
+    its changes are exported.
+
+    """
+
+    def __init__(self, config, db, directory:str=None):
+        self.config, self.db, self.directory = config, db, directory
+        self.guard = threading.Lock()
+        self.pending = self.running = False
+
+    def request(self):
+        """Export the site as soon as possible, without waiting for it"""
+        with self.guard:
+            self.pending = True
+            if self.running:
+                return
+            self.running = True
+        threading.Thread(target=self._run, name='export').start()
+
+    def _run(self):
+        while True:
+            with self.guard:
+                if not self.pending:
+                    self.running = False
+                    return
+                self.pending = False
+            try:
+                export_site(self.config, self.db, self.directory)
+            except Exception as error:  # exported again at next change
+                print('ERROR: export of the site failed: {}'.format(error))
@@ -0,0 +1,78 @@
+"""Atom and RSS feeds of the newest links.
+
+Feeds are built from the links only: neither markdown nor the templates
+are involved, descriptions being given as text.
+
+"""
+
+
+import time
+import xml.etree.ElementTree as ET
+from email.utils import formatdate
+
+
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+CONTENT_TYPES = {
+    'atom': 'application/atom+xml; charset=utf-8',
+    'rss': 'application/rss+xml; charset=utf-8',
+}
+
+
+def rfc3339(timestamp:int) -> str:
+    """Return given timestamp as a date in Atom
+
+    >>> rfc3339(1500000000)
+    '2017-07-14T02:40:00Z'
+
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def sub(parent, tag:str, text:str=None, **attrib) -> ET.Element:
+    element = ET.SubElement(parent, tag, attrib)
+    element.text = text
+    return element
+
+
+def atom(config, links:tuple) -> str:
+    """Return the Atom feed of given links, from the newest"""
+    root = ET.Element('feed', xmlns=ATOM_NAMESPACE)
+    sub(root, 'title', config.html.title)
+    sub(root, 'id', config.server.url)
+    sub(root, 'link', href=config.server.url)
+    sub(root, 'link', rel='self', href=config.server.url + '/feed.atom')
+    sub(root, 'updated', rfc3339(links[0].publication_date if links else 0))
+    for link in links:
+        entry = sub(root, 'entry')
+        sub(entry, 'title', link.title)
+        sub(entry, 'id', link.url)
+        sub(entry, 'link', href=link.url)
+        sub(entry, 'updated', rfc3339(link.publication_date))
+        sub(entry, 'summary', link.description)
+        for tag in link.tags:
+            sub(entry, 'category', term=tag)
+    return ET.tostring(root, encoding='unicode', xml_declaration=True)
+
+
+def rss(config, links:tuple) -> str:
+    """Return the RSS 2.0 feed of given links, from the newest"""
+    root = ET.Element('rss', version='2.0')
+    channel = sub(root, 'channel')
+    sub(channel, 'title', config.html.title)
+    sub(channel, 'link', config.server.url)
+    sub(channel, 'description', config.html.title)
+    if links:
+        sub(channel, 'lastBuildDate', formatdate(links[0].publication_date, usegmt=True))
+    for link in links:
+        item = sub(channel, 'item')
+        sub(item, 'title', link.title)
+        sub(item, 'link', link.url)
+        sub(item, 'guid', link.url)
+        sub(item, 'pubDate', formatdate(link.publication_date, usegmt=True))
+        sub(item, 'description', link.description)
+        for tag in link.tags:
+            sub(item, 'category', tag)
+    return ET.tostring(root, encoding='unicode', xml_declaration=True)
+
+
+FORMATS = {'atom': atom, 'rss': rss}
@@ -0,0 +1,205 @@
+"""Bulk import of links from dumps of other tools.
+
+Supported formats:
+- jsonl: one JSON object per line, with keys title, description, url,
+  publication_date (or date, created, timestamp), as a timestamp
+  or an ISO 8601 date, and tags, as a list or a text
+- csv: a header line naming the same columns, then one link per line
+- netscape: the bookmark HTML export of browsers and Shaarli
+
+Input is read as a stream. Links are sorted by date in runs of RUN_SIZE
+links, written in temporary files when there is more than one run,
+and merged (external merge sort) with the links already in the database,
+while the database is rewritten (see StorageInterface.rewrite).
+
+"""
+
+
+import os
+import csv
+import json
+import heapq
+import tempfile
+import itertools
+from datetime import datetime
+from html.parser import HTMLParser
+
+from shaarpli.data import encode_links
+from shaarpli.commons import Link
+from shaarpli.index import file_lock
+from shaarpli.records import DSV, RecordFormat
+
+
+RUN_SIZE = 50000  # number of links sorted in memory at once
+WRITE_BLOCK = 1024  # number of links encoded at once
+DATE_KEYS = ('publication_date', 'date', 'created', 'timestamp')
+FORMATS = {  # file extension -> format
+    '.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv',
+    '.html': 'netscape', '.htm': 'netscape',
+}
+
+
+def timestamp(value) -> int:
+    """Return given date, timestamp or ISO 8601 date, as a timestamp
+
+    >>> timestamp(1500000000)
+    1500000000
+    >>> timestamp('1500000000.5')
+    1500000000
+    >>> timestamp('2017-07-14T02:40:00+00:00')
+    1500000000
+
+    """
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def link_from_dict(fields:dict) -> Link:
+    """Return the Link described by given fields"""
+    date = next((fields[key] for key in DATE_KEYS if fields.get(key)), 0)
+    url = fields.get('url') or ''
+    return Link(fields.get('title') or url, fields.get('description') or '',
+                url, timestamp(date), fields.get('tags') or ())
+
+
+def read_jsonl(fd) -> iter:
+    """Yield the links of given JSON lines file object"""
+    for line in fd:
+        if line.strip():
+            yield link_from_dict(json.loads(line))
+
+
+def read_csv(fd) -> iter:
+    """Yield the links of given CSV file object, starting by a header"""
+    for fields in csv.DictReader(fd):
+        yield link_from_dict(fields)
+
+
+class NetscapeParser(HTMLParser):
+    """Parser of the Netscape bookmark file format, fed by chunks.
+
+    Links found are accumulated in the links attribute.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.current = None  # fields of the link being read
+        self.target = None  # field receiving the text
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.end_link()
+            attrs = dict(attrs)
+            self.current = {'url': attrs.get('href'), 'date': attrs.get('add_date'),
+                            'tags': attrs.get('tags'), 'title': '', 'description': ''}
+            self.target = 'title'
+        elif tag == 'dd' and self.current:
+            self.target = 'description'
+        elif tag in {'dt', 'dl', 'h3'}:
+            self.end_link()
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self.target = None
+        elif tag == 'dl':
+            self.end_link()
+
+    def handle_data(self, data):
+        if self.current and self.target:
+            self.current[self.target] += data
+
+    def end_link(self):
+        if self.current:
+            self.current = {key: value.strip() if isinstance(value, str) else value
+                            for key, value in self.current.items()}
+            self.links.append(link_from_dict(self.current))
+        self.current, self.target = None, None
+
+    def close(self):
+        super().close()
+        self.end_link()
+
+
+def read_netscape(fd) -> iter:
+    """Yield the links of given Netscape bookmark file object"""
+    parser = NetscapeParser()
+    for line in fd:
+        parser.feed(line)
+        yield from parser.links
+        parser.links.clear()
+    parser.close()
+    yield from parser.links
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'netscape': read_netscape}
+
+
+def guess_format(filename:str) -> str or None:
+    """Return the format of given file, according to its extension"""
+    return FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def sorted_runs(links:iter, directory:str, newest_first:bool) -> list:
+    """Return iterables of given links, each one sorted by date.
+
+    Runs of RUN_SIZE links are sorted in memory. Unless there is
+    only one run, they are written in given directory.
+
+    """
+    key = lambda link: link.publication_date
+    runs = []
+    while True:
+        run = sorted(itertools.islice(links, RUN_SIZE), key=key, reverse=newest_first)
+        if not run:
+            break
+        runs.append(run)
+        if len(run) == RUN_SIZE:  # more to come: free the memory
+            runs[-1] = write_run(run, os.path.join(directory, 'run{}'.format(len(runs))))
+    return runs
+
+
+def write_run(links:list, filename:str) -> iter:
+    """Write given links in given file, and return an iterable over them"""
+    with open(filename, 'wb') as fd:
+        for start in range(0, len(links), WRITE_BLOCK):
+            fd.write(encode_links(links[start:start + WRITE_BLOCK])[0])
+    return read_links(filename)
+
+
+def read_links(filename:str, record_format:RecordFormat=DSV) -> iter:
+    """Yield the links of given database file"""
+    with open(filename, 'rb') as fd:
+        for _, row in record_format.read(fd):
+            yield Link.from_dsv(row)
+
+
+def import_links(links:iter, handler) -> int:
+    """Add given links to the database of given handler (see storage.py),
+    all links being sorted by date. Return the number of links added.
+
+    The database is rewritten once, with the write lock held.
+    Links already in the database are expected to be sorted by date.
+
+    """
+    assert not handler.queue, "links can't be imported in a queue"
+    database = handler.name
+    newest_first = not handler.newest_last  # order of the rewrite
+    workdir = os.path.dirname(os.path.abspath(database))
+    nb_imported = 0
+
+    def counted(links):
+        nonlocal nb_imported
+        for nb_imported, link in enumerate(links, start=1):
+            yield link
+
+    with file_lock(database), tempfile.TemporaryDirectory(dir=workdir) as directory:
+        runs = sorted_runs(counted(links), directory, newest_first)
+        runs.append(handler.links if newest_first else handler.links_oldest_first())  # already sorted
+        merged = heapq.merge(*runs, key=lambda link: link.publication_date,
+                             reverse=newest_first)
+        handler.rewrite(merged)
+    return nb_imported
@@ -0,0 +1,442 @@
+"""Persistent index of record offsets for databases, whatever their format
+(see records.py).
+
+The index of a database is stored next to it, in a sidecar file
+with the .idx extension. It begins with a header giving the size and
+modification time of the database it describes, followed by the byte
+offset of each record, in database order, as fixed-width integers.
+Invalid records (see Link.check) are not indexed, so that readers
+do not check the records they read.
+
+This allows one to seek to any record without parsing the preceding ones.
+An index that do not match its database anymore (edited by hand,
+or by a writer not aware of the index) is detected and rebuilt.
+
+Writers rewriting a database build the new version in a temporary file,
+write its index, then replace the database with it. Readers opening both
+files check that the index describes the opened database (see snapshot),
+and keep reading the version they opened even if it is replaced.
+
+The head cursor of a database is stored in a sidecar file with the
+.head extension. It gives the first record of a database used as a queue,
+so that dequeuing do not need to rewrite the file. The digests of the last
+dequeued record and of the first one allow to find the head again
+in a database replaced by another writer.
+
+The generation of a database is stored in a sidecar file with the .gen
+extension. It is increased at each change of the database.
+
+The write lock of a database is an advisory lock (fcntl) on a sidecar
+file with the .lock extension.
+
+"""
+
+
+import os
+import struct
+import hashlib
+import threading
+import contextlib
+from array import array
+
+from shaarpli.commons import Link
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX system: locks are local to the process
+    fcntl = None
+
+
+INDEX_EXT = '.idx'
+HEAD_EXT = '.head'
+GENERATION_EXT = '.gen'
+LOCK_EXT = '.lock'
+FILE_LOCKS = {}  # lock file -> [thread lock, file descriptor, depth]
+FILE_LOCKS_GUARD = threading.Lock()
+SNAPSHOT_ATTEMPTS = 5  # number of tries to get an index matching the database
+HEADER = struct.Struct('<QQ')  # size and mtime (ns) of the indexed database
+ENTRY = struct.Struct('<Q')  # byte offset of a record
+assert array('Q').itemsize == ENTRY.size
+
+
+def index_name(database:str) -> str:
+    return database + INDEX_EXT
+
+
+def tempname(filename:str) -> str:
+    """Return a temporary name for given file, proper to the current thread"""
+    return '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+
+
+def signature(database:str or int) -> tuple:
+    """Return (size, mtime in ns) of given file or file descriptor,
+    or (0, 0) if it doesn't exist"""
+    try:
+        stat = os.stat(database)
+    except FileNotFoundError:
+        return 0, 0
+    return stat.st_size, stat.st_mtime_ns
+
+
+@contextlib.contextmanager
+def file_lock(database:str):
+    """Hold the write lock of given database, for all threads and processes.
+
+    The lock is reentrant for a thread.
+
+    """
+    name = os.path.abspath(database) + LOCK_EXT
+    with FILE_LOCKS_GUARD:
+        if name not in FILE_LOCKS:
+            FILE_LOCKS[name] = [threading.RLock(), None, 0]
+        lock = FILE_LOCKS[name]
+    with lock[0]:
+        if lock[2] == 0:
+            lock[1] = open(name, 'a')
+            if fcntl:
+                fcntl.flock(lock[1], fcntl.LOCK_EX)
+        lock[2] += 1
+        try:
+            yield
+        finally:
+            lock[2] -= 1
+            if lock[2] == 0:
+                if fcntl:
+                    fcntl.flock(lock[1], fcntl.LOCK_UN)
+                lock[1].close()
+
+
+def scan_offsets(database:str, record_format) -> (tuple, array):
+    """Return the signature of given database, and the offsets
+    of its valid records, by parsing it in given format (see records.py).
+
+    Invalid records are not indexed: readers, reading the records
+    listed by the index, do not need to check them.
+
+    """
+    try:
+        with open(database, 'rb') as fd:
+            return (signature(fd.fileno()),
+                    array('Q', valid_offsets(database, record_format.read(fd))))
+    except FileNotFoundError:
+        return (0, 0), array('Q')
+
+
+def valid_offsets(database:str, records:iter) -> iter:
+    """Yield the offsets of the valid records among given (offset, row)"""
+    for offset, row in records:
+        try:
+            Link.check(row)
+        except ValueError as error:
+            print('Record at offset {} of {} is ignored: {}'.format(offset, database, error))
+            continue
+        yield offset
+
+
+class IndexSnapshot:
+    """Index as it was when opened, even if it is replaced since"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.header = HEADER.unpack(fd.read(HEADER.size))
+
+    def __len__(self) -> int:
+        return (os.fstat(self.fd.fileno()).st_size - HEADER.size) // ENTRY.size
+
+    def offset(self, nb:int) -> int or None:
+        """Return the offset of record *nb* (starting at 0),
+        or None if there is no such record."""
+        self.fd.seek(HEADER.size + nb * ENTRY.size)
+        entry = self.fd.read(ENTRY.size)
+        return ENTRY.unpack(entry)[0] if len(entry) == ENTRY.size else None
+
+    def offsets(self, start:int=0, stop:int=None) -> array:
+        """Return the offsets of records *start* to *stop* (excluded),
+        in database order. By default, all offsets are returned."""
+        offsets = array('Q')
+        self.fd.seek(HEADER.size + start * ENTRY.size)
+        if stop is None:
+            offsets.frombytes(self.fd.read())
+        else:
+            entries = self.fd.read(max(0, stop - start) * ENTRY.size)
+            offsets.frombytes(entries[:len(entries) - len(entries) % ENTRY.size])
+        return offsets
+
+    def close(self):
+        self.fd.close()
+
+
+class OffsetIndex:
+    """Access to the index of a database.
+
+    Offsets are read on demand from the sidecar file, so retrieving
+    the offset of a record or the number of records costs the same
+    whatever the size of the database.
+
+    """
+
+    def __init__(self, database:str, record_format):
+        self.database = database
+        self.name = index_name(database)
+        self.record_format = record_format
+
+    def _header(self) -> tuple or None:
+        try:
+            with open(self.name, 'rb') as fd:
+                return HEADER.unpack(fd.read(HEADER.size))
+        except (FileNotFoundError, struct.error):
+            return None
+
+    def refresh(self) -> bool:
+        """Rebuild the index if it do not describe the database anymore.
+        Return True if it was rebuilt.
+
+        Since the index of a database being written may not describe it
+        for a moment, rebuilding is done with the write lock.
+
+        """
+        if self._header() == signature(self.database):
+            return False
+        with file_lock(self.database):
+            if self._header() == signature(self.database):
+                return False  # was written meanwhile
+            self.write(*reversed(scan_offsets(self.database, self.record_format)))
+            Generation(self.database).increment()  # changed by someone else
+            return True
+
+    def open(self) -> IndexSnapshot or None:
+        """Return the index as it is now, or None if there is no index"""
+        try:
+            return IndexSnapshot(open(self.name, 'rb'))
+        except (FileNotFoundError, struct.error):
+            return None
+
+    def snapshot(self) -> (object, IndexSnapshot):
+        """Return the database opened as a binary file object, and its index.
+
+        Both describe the same version of the database, that can be read
+        until they are closed, whatever the writers do meanwhile.
+        Return (None, None) if there is no database.
+
+        """
+        for _ in range(SNAPSHOT_ATTEMPTS):
+            try:
+                database = open(self.database, 'rb')
+            except FileNotFoundError:
+                return None, None
+            index = self.open()
+            if index is not None and index.header == signature(database.fileno()):
+                return database, index
+            database.close()
+            if index is not None:
+                index.close()
+            self.refresh()  # wait for the writer, or rebuild
+        raise RuntimeError("Index of {} do not stabilize".format(self.database))
+
+    def __len__(self) -> int:
+        """Number of records in the database"""
+        index = self.open()
+        if index is None:
+            return 0
+        with contextlib.closing(index):
+            return len(index)
+
+    def offset(self, nb:int) -> int or None:
+        """Return the offset of record *nb* (starting at 0),
+        or None if there is no such record."""
+        index = self.open()
+        if index is None:
+            return None
+        with contextlib.closing(index):
+            return index.offset(nb)
+
+    def offsets(self, start:int=0, stop:int=None) -> array:
+        """Return the offsets of records *start* to *stop* (excluded),
+        in database order. By default, all offsets are returned."""
+        index = self.open()
+        if index is None:
+            return array('Q')
+        with contextlib.closing(index):
+            return index.offsets(start, stop)
+
+    def write(self, offsets:array, database_signature:tuple=None):
+        """Atomically replace the index by given offsets, describing
+        the database with given signature (by default the current one)"""
+        tmp = tempname(self.name)
+        with open(tmp, 'wb') as fd:
+            fd.write(HEADER.pack(*(database_signature or signature(self.database))))
+            offsets.tofile(fd)
+        os.replace(tmp, self.name)
+
+    def replace_database(self, new_database:str, offsets:array):
+        """Replace the database by given file, after writing its index"""
+        self.write(offsets, signature(new_database))
+        os.replace(new_database, self.database)
+
+
+    # Incremental updates, called by writers with the write lock.
+    #  They expect the index to be valid for the database before writing.
+
+    def prepended(self, offsets:array, size:int, new_database:str):
+        """Replace database by given file, made of a block of *size* bytes
+        containing records at given offsets followed by the database"""
+        self.replace_database(
+            new_database,
+            offsets + array('Q', (offset + size for offset in self.offsets()))
+        )
+
+    def appended(self, offsets:array, start:int):
+        """Update index after the appending of records at given offsets,
+        relative to *start*, the size of the database before appending.
+
+        New offsets are appended in place, then the header is updated:
+        if interrupted between both, the index will be rebuilt.
+
+        """
+        with open(self.name, 'r+b') as fd:
+            fd.seek(0, os.SEEK_END)
+            array('Q', (offset + start for offset in offsets)).tofile(fd)
+            fd.seek(0)
+            fd.write(HEADER.pack(*signature(self.database)))
+
+    def dropped(self, nb:int, new_database:str):
+        """Replace database by given file, which is the database
+        without its *nb* first records"""
+        offsets = self.offsets()[nb:]
+        start = offsets[0] if offsets else 0
+        self.replace_database(new_database, array('Q', (offset - start for offset in offsets)))
+
+
+def record_digests(database:str, index, start:int=0, stop:int=None) -> iter:
+    """Yield the digest of the bytes of records *start* to *stop* (excluded)
+    of given database, as delimited by given index"""
+    offsets = index.offsets(start, None if stop is None else stop + 1)
+    with open(database, 'rb') as fd:
+        fd.seek(offsets[0] if offsets else 0)
+        for nb, offset in enumerate(offsets):
+            if stop is not None and start + nb >= stop:
+                return
+            end = offsets[nb + 1] if nb + 1 < len(offsets) else None
+            data = fd.read(-1 if end is None else end - offset)
+            yield hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class HeadCursor:
+    """Persistent position of the first record of a database used as a queue.
+
+    The cursor holds the offset and the number of the first record,
+    the inode of the database it applies to, and the digests
+    of the last dequeued record and of the first record ('-' if none).
+
+    If the database was replaced since (by an editor, or a copy), the head
+    is found again by the digests, the last dequeued record first.
+    If none is found, the dequeued records can't be told apart:
+    the whole queue is considered dequeued, until the cursor is removed.
+
+    """
+    NO_DIGEST = '-'
+
+    def __init__(self, database:str):
+        self.database = database
+        self.name = database + HEAD_EXT
+        self._checked = None  # (cursor, signature of database) -> head
+
+    def get(self, index:OffsetIndex) -> (int, int):
+        """Return (offset, record number) of the first record, validated
+        against given up-to-date index of the database"""
+        try:
+            with open(self.name) as fd:
+                cursor = fd.read()
+        except FileNotFoundError:
+            return 0, 0
+        key = cursor, signature(self.database)
+        checked = self._checked
+        if checked is None or checked[0] != key:
+            checked = self._checked = key, self._check(cursor.split(), index)
+        return checked[1]
+
+    def _check(self, fields:list, index:OffsetIndex) -> (int, int):
+        """Return the head given by the fields of the cursor, validated
+        against given index, or found again in the database"""
+        try:
+            offset, record, inode = map(int, fields[:3])
+        except ValueError:
+            return 0, 0
+        dequeued, first = (fields[3:] + [self.NO_DIGEST] * 2)[:2]  # absent from older cursors
+        if record == 0:  # nothing dequeued since the database was written
+            return 0, 0
+        try:
+            valid = inode == os.stat(self.database).st_ino
+        except FileNotFoundError:
+            return 0, 0
+        if valid and record == len(index):
+            valid = offset == os.path.getsize(self.database)
+        elif valid:
+            valid = index.offset(record) == offset
+        if valid and dequeued != self.NO_DIGEST:
+            valid = tuple(record_digests(self.database, index, record - 1, record)) == (dequeued,)
+        if valid:
+            return offset, record
+        record = self._find(index, dequeued, first)
+        if record is None:
+            print('Head cursor of {} do not match database anymore, and the dequeued'
+                  ' links are not found: the queue is considered empty. Remove {}'
+                  ' to dequeue again from the first link.'.format(self.database, self.name))
+            record = len(index)
+        else:
+            print('Head cursor of {} do not match database anymore, and is moved'
+                  ' to link {}.'.format(self.database, record))
+        offset = index.offset(record)
+        return (os.path.getsize(self.database) if offset is None else offset), record
+
+    def _find(self, index:OffsetIndex, dequeued:str, first:str) -> int or None:
+        """Return the number of the record following the one of digest
+        *dequeued*, or else the one of digest *first*, or None if not found"""
+        first_found = None
+        for record, digest in enumerate(record_digests(self.database, index)):
+            if digest == dequeued:
+                return record + 1
+            if digest == first and first_found is None:
+                first_found = record
+        return first_found
+
+    def set(self, offset:int, record:int, index:OffsetIndex):
+        """Atomically move the cursor to given record,
+        given index being up-to-date"""
+        dequeued = first = self.NO_DIGEST
+        for nb, digest in enumerate(record_digests(self.database, index, max(0, record - 1), record + 1),
+                                    start=max(0, record - 1)):
+            if nb < record:
+                dequeued = digest
+            else:
+                first = digest
+        tmp = tempname(self.name)
+        with open(tmp, 'w') as fd:
+            fd.write('{} {} {} {} {}'.format(offset, record, os.stat(self.database).st_ino,
+                                             dequeued, first))
+        os.replace(tmp, self.name)
+
+
+class Generation:
+    """Persistent number of the version of a database,
+    increased by writers, with the write lock held"""
+
+    def __init__(self, database:str):
+        self.database = database
+        self.name = database + GENERATION_EXT
+
+    def get(self) -> int:
+        try:
+            with open(self.name) as fd:
+                return int(fd.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def increment(self) -> int:
+        """Increase the generation, and return the new value"""
+        generation = self.get() + 1
+        tmp = tempname(self.name)
+        with open(tmp, 'w') as fd:
+            fd.write(str(generation))
+        os.replace(tmp, self.name)
+        return generation
@@ -0,0 +1,122 @@
+"""Timing of requests, and exposition of metrics in Prometheus text format.
+
+A request is timed as a whole, and by spans: named parts of its handling,
+like the check of the database or the rendering of links.
+Durations are accumulated in histograms, exposed with the counters
+of the caches by prometheus(). Requests slower than a threshold
+are logged with the duration of their spans.
+
+Metrics are proper to the process: with several workers, each one
+exposes its own.
+
+"""
+
+
+import time
+import bisect
+import threading
+import contextlib
+import functools
+
+
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5.)  # in seconds
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+HISTOGRAMS = {}  # span name -> [count per bucket (last is +Inf), count, sum]
+COUNTERS = {}  # name -> value
+LOCK = threading.Lock()
+CURRENT = threading.local()  # spans of the request handled by the thread
+
+
+def observe(name:str, duration:float):
+    """Add given duration in seconds to the histogram of given span"""
+    with LOCK:
+        if name not in HISTOGRAMS:
+            HISTOGRAMS[name] = [[0] * (len(BUCKETS) + 1), 0, 0.]
+        histogram = HISTOGRAMS[name]
+        histogram[0][bisect.bisect_left(BUCKETS, duration)] += 1
+        histogram[1] += 1
+        histogram[2] += duration
+
+
+def count(name:str, value:int=1):
+    """Increase given counter"""
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def span(name:str):
+    """Time the enclosed code as given span of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        observe(name, duration)
+        spans = getattr(CURRENT, 'spans', None)
+        if spans is not None:
+            spans.append((name, duration))
+
+
+def timed_request(slow_threshold:float=0.):
+    """Decorator of a function handling a request, receiving the environment.
+
+    The request is timed, and logged with its spans if it lasted
+    more than *slow_threshold* seconds (0 for no log).
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(env, *args, **kwargs):
+            CURRENT.spans = []
+            start = time.perf_counter()
+            try:
+                return func(env, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                observe('request', duration)
+                count('requests')
+                if slow_threshold and duration >= slow_threshold:
+                    count('slow_requests')
+                    print('SLOW REQUEST {} ({:.1f} ms): {}'.format(
+                        env.get('REQUEST_URI'), duration * 1000,
+                        ', '.join('{} {:.1f} ms'.format(name, span_duration * 1000)
+                                  for name, span_duration in CURRENT.spans)
+                    ))
+                CURRENT.spans = None
+        return wrapper
+    return decorator
+
+
+def prometheus(caches:dict) -> str:
+    """Return all metrics in Prometheus text format.
+
+    caches -- name -> cache, whose stats() are exposed
+
+    """
+    lines = []
+    with LOCK:
+        counters = dict(COUNTERS)
+        histograms = {name: (list(buckets), nb, total)
+                      for name, (buckets, nb, total) in HISTOGRAMS.items()}
+    for name, value in sorted(counters.items()):
+        lines += ['# TYPE shaarpli_{}_total counter'.format(name),
+                  'shaarpli_{}_total {}'.format(name, value)]
+    lines.append('# TYPE shaarpli_span_seconds histogram')
+    for name, (buckets, nb, total) in sorted(histograms.items()):
+        cumulated = 0
+        for bound, bucket in zip(BUCKETS + ('+Inf',), buckets):
+            cumulated += bucket
+            lines.append('shaarpli_span_seconds_bucket{{span="{}",le="{}"}} {}'
+                         ''.format(name, bound, cumulated))
+        lines += ['shaarpli_span_seconds_sum{{span="{}"}} {}'.format(name, total),
+                  'shaarpli_span_seconds_count{{span="{}"}} {}'.format(name, nb)]
+    stats = {name: cache.stats() for name, cache in caches.items() if cache is not None}
+    for stat, kind in (('hits', 'counter'), ('misses', 'counter'),
+                       ('evictions', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge')):
+        metric = 'shaarpli_cache_' + stat + ('_total' if kind == 'counter' else '')
+        lines.append('# TYPE {} {}'.format(metric, kind))
+        lines += ['{}{{cache="{}"}} {}'.format(metric, name, cache_stats[stat])
+                  for name, cache_stats in sorted(stats.items())
+                  if stat in cache_stats]  # bytes are known only for memory caches
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,265 @@
+"""Encodings of the records of a database file.
+
+A record holds the fields of a link (see Link.to_dsv), as text.
+The encoding of a database is chosen by database.format in config:
+
+- dsv: fields are separated by the DSV field separator, and records by
+  newlines. Because of csv limitation on record separator (only \\n
+  and \\r are valid, and synonymous), fields are enclosed in double quotes
+  and escaped as needed, so each record is parsed by csv.
+  See https://en.wikipedia.org/wiki/Delimiter#ASCII_delimited_text
+- binary: a record begins with its size in bytes, its number of fields
+  and the end of each one in the record, as fixed-width integers,
+  followed by the fields in UTF-8. Files are mapped in memory once
+  per reading (see mapped), and fields are decoded only when accessed
+  (see BinaryRow), so reading a record costs a copy of its bytes.
+
+Both are indexed the same way (see index.py), and rewritten the same way
+(see data.py). Records are read at the offsets given by the index,
+which only lists the valid ones: they are checked once, when indexed. convert() rewrites a database in another encoding,
+without loss.
+
+"""
+
+
+import io
+import os
+import sys
+import csv
+import mmap
+import struct
+import itertools
+import contextlib
+from array import array
+
+
+DSV_FIELD_SEP = chr(31)
+DSV_RECORD_SEP = chr(30)
+CSV_PARAMS = {
+    'delimiter': DSV_FIELD_SEP,
+    # 'lineterminator': DSV_RECORD_SEP,  # NOT HANDLED BY PYTHON. NOT A JOKE. WTF PYTHON.
+    'lineterminator': '\n',
+}
+RECORD_HEADER = struct.Struct('<IB')  # size and number of fields of a binary record
+FIELD_ENDS = tuple(struct.Struct('<' + 'I' * nb) for nb in range(256))  # end of each field
+
+
+@contextlib.contextmanager
+def unmapped(fd):
+    """Context manager giving given file object as is, to read it unmapped"""
+    yield fd
+
+
+class RecordFormat:
+    """Methods expected from an encoding of records"""
+    name = None
+
+    def encode(self, rows:iter) -> (bytes, array):
+        """Return the encoding of given rows (sequences of fields),
+        and the offset of each record in it"""
+        raise NotImplementedError
+
+    def read(self, fd) -> iter:
+        """Yield (offset, row) for each record found in given binary
+        file object, starting at its current position."""
+        raise NotImplementedError
+
+    def mapped(self, fd):
+        """Return a context manager giving the source of rows and row_at
+        for given binary file object: the file object itself by default"""
+        return unmapped(fd)
+
+    def rows(self, fd, offsets:array, stop:int=None) -> iter:
+        """Yield the rows of given source (see mapped) at given offsets,
+        in increasing order, as given by the index: the records between
+        them (invalid ones, see index.scan_offsets) are skipped.
+        *stop* is the end of the last record, if known."""
+        expected = iter(offsets)
+        next_offset = next(expected, None)
+        if next_offset is None:
+            return
+        for offset, row in self.read_block(fd, next_offset, stop):
+            if offset == next_offset:
+                yield row
+                next_offset = next(expected, None)
+                if next_offset is None:
+                    return
+
+    def read_block(self, fd, start:int, stop:int=None) -> iter:
+        """Yield (offset, row) for each record of given binary file object,
+        from offset *start* to offset *stop* (end of file by default)"""
+        fd.seek(start)
+        for offset, row in self.read(fd):
+            if stop is not None and offset >= stop:
+                return
+            yield offset, row
+
+    def row_at(self, fd, offset:int):
+        """Return the row of given source (see mapped) at given offset,
+        or None if there is no record"""
+        fd.seek(offset)
+        for _, row in self.read(fd):
+            return row
+        return None
+
+
+class DSVFormat(RecordFormat):
+    name = 'dsv'
+
+    def encode(self, rows:iter) -> (bytes, array):
+        offsets, block = array('Q'), io.BytesIO()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, **CSV_PARAMS)
+        for row in rows:
+            offsets.append(block.tell())
+            writer.writerow(row)
+            block.write(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+        return block.getvalue(), offsets
+
+    def read(self, fd) -> iter:
+        lines = (line.decode('utf-8') for line in iter(fd.readline, b''))
+        reader = csv.reader(lines, **CSV_PARAMS)
+        while True:
+            offset = fd.tell()
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            if row:  # empty lines are not records
+                yield offset, row
+
+    def read_block(self, fd, start:int, stop:int=None) -> iter:
+        if stop is None:
+            yield from super().read_block(fd, start)
+            return
+        fd.seek(start)  # the block is read at once, then parsed
+        for offset, row in self.read(io.BytesIO(fd.read(stop - start))):
+            yield start + offset, row
+
+
+class BinaryRow:
+    """Fields of a binary record, decoded when accessed.
+
+    data -- the record, as written in the database
+    bounds -- start of each field in data, followed by the end of the last one,
+              found at first access
+
+    """
+    __slots__ = ('data', 'bounds')
+
+    def __init__(self, data:bytes):
+        self.data = data
+        self.bounds = None
+
+    def __len__(self) -> int:
+        return self.data[RECORD_HEADER.size - 1]
+
+    def __getitem__(self, nb:int) -> str:
+        bounds = self.bounds
+        if bounds is None:
+            header = FIELD_ENDS[self.data[RECORD_HEADER.size - 1]]
+            bounds = self.bounds = ((RECORD_HEADER.size + header.size,)
+                                    + header.unpack_from(self.data, RECORD_HEADER.size))
+        if nb < 0:
+            nb += len(bounds) - 1
+        if not 0 <= nb < len(bounds) - 1:
+            raise IndexError('record field {} out of range'.format(nb))
+        return str(self.data[bounds[nb]:bounds[nb + 1]], 'utf-8')
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.data) + sys.getsizeof(self.bounds)
+
+
+class BinaryFormat(RecordFormat):
+    name = 'binary'
+
+    def encode(self, rows:iter) -> (bytes, array):
+        offsets, block = array('Q'), io.BytesIO()
+        for row in rows:
+            offsets.append(block.tell())
+            fields = [str(field).encode('utf-8') for field in row]
+            header = FIELD_ENDS[len(fields)]
+            ends = tuple(itertools.accumulate(map(len, fields),
+                                              initial=RECORD_HEADER.size + header.size))[1:]
+            size = ends[-1] if ends else RECORD_HEADER.size + header.size
+            block.write(RECORD_HEADER.pack(size, len(fields)))
+            block.write(header.pack(*ends))
+            block.write(b''.join(fields))
+        return block.getvalue(), offsets
+
+    def read(self, fd) -> iter:
+        while True:
+            offset = fd.tell()
+            header = fd.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:  # end of file, or truncated record
+                return
+            size = RECORD_HEADER.unpack(header)[0]
+            data = header + fd.read(max(0, size - len(header)))
+            if len(data) < size or size < RECORD_HEADER.size:  # truncated or invalid record
+                return
+            yield offset, BinaryRow(data)
+
+    def mapped(self, fd):
+        """Return a context manager giving the file mapped in memory,
+        or the file object itself if empty (it can't be mapped)"""
+        if os.fstat(fd.fileno()).st_size == 0:
+            return unmapped(fd)
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def row_at(self, buffer, offset:int) -> BinaryRow or None:
+        if not isinstance(buffer, mmap.mmap):
+            with self.mapped(buffer) as buffer:
+                return self.row_at(buffer, offset) if isinstance(buffer, mmap.mmap) else None
+        if offset + RECORD_HEADER.size > len(buffer):
+            return None
+        size = RECORD_HEADER.unpack_from(buffer, offset)[0]
+        if offset + size > len(buffer) or size < RECORD_HEADER.size:  # truncated or invalid record
+            return None
+        return BinaryRow(buffer[offset:offset + size])
+
+    def rows(self, buffer, offsets:array, stop:int=None) -> iter:
+        if not isinstance(buffer, mmap.mmap):
+            with self.mapped(buffer) as buffer:
+                if isinstance(buffer, mmap.mmap):
+                    yield from self.rows(buffer, offsets, stop)
+            return
+        unpack, end = RECORD_HEADER.unpack_from, len(buffer)
+        for offset in offsets:  # each record is sliced from the mapping
+            size = unpack(buffer, offset)[0]
+            if offset + size > end or size < RECORD_HEADER.size:  # truncated or invalid record
+                return
+            yield BinaryRow(buffer[offset:offset + size])
+
+
+DSV = DSVFormat()
+BINARY = BinaryFormat()
+FORMATS = {record_format.name: record_format for record_format in (DSV, BINARY)}
+EXTENSIONS = {'dsv': '.csv', 'binary': '.bin'}  # format -> usual extension of databases
+
+
+def get(name:str) -> RecordFormat:
+    """Return the format of given name, as found in database.format"""
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError('Unknown database format {}. Expected one of {}.'
+                         ''.format(name, ', '.join(FORMATS)))
+
+
+def convert(source:str, source_format:RecordFormat,
+            target:str, target_format:RecordFormat, block:int=1024) -> int:
+    """Write the records of given source database in given target file,
+    in another format. Fields are copied as they are.
+    Return the number of records."""
+    nb_record = 0
+    with open(source, 'rb') as infd, open(target, 'wb') as outfd:
+        rows = []
+        for _, row in source_format.read(infd):
+            rows.append(tuple(row))
+            if len(rows) == block:
+                outfd.write(target_format.encode(rows)[0])
+                nb_record, rows = nb_record + len(rows), []
+        outfd.write(target_format.encode(rows)[0])
+    return nb_record + len(rows)
@@ -0,0 +1,138 @@
+"""Definition of the response sent to end-user, with HTTP caching.
+
+A Response is built once for a rendered page, and kept in cache with it.
+It provides the ETag (hash of content) and Last-Modified (modification
+of the database) headers, answers to conditional requests with
+a 304 Not Modified, and compresses its body once per encoding.
+
+Brotli is used if the brotli module is installed, gzip otherwise.
+
+"""
+
+
+import sys
+import gzip
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # not in standard library
+    brotli = None
+
+
+COMPRESSORS = {  # encoding -> function compressing bytes
+    'gzip': lambda body: gzip.compress(body, compresslevel=9, mtime=0),
+}
+if brotli:
+    COMPRESSORS['br'] = brotli.compress
+PREFERRED_ENCODINGS = ('br', 'gzip')
+MIN_COMPRESSED_SIZE = 512  # smaller bodies are not compressed
+
+
+class Response:
+    """Html content sent to end-user, and its HTTP metadata.
+
+    html -- the content
+    last_modified -- timestamp of last modification of the content, if known
+    cache_control -- value of the Cache-Control header, or None for no caching
+    generation -- generation of the database the content was built from, if any
+    content_type -- value of the Content-Type header
+
+    """
+
+    def __init__(self, html:str, last_modified:float=None,
+                 cache_control:str='no-cache', generation:int=None,
+                 content_type:str='text/html; charset=utf-8'):
+        self.html = html
+        self.body = html.encode()
+        self.etag = '"{}"'.format(hashlib.blake2b(self.body, digest_size=16).hexdigest())
+        self.last_modified = int(last_modified) if last_modified else None
+        self.cache_control = cache_control
+        self.generation = generation
+        self.content_type = content_type
+        self._bodies = {'identity': self.body}  # encoding -> encoded body
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self.__dict__)
+                + sys.getsizeof(self.html) + sys.getsizeof(self.etag)
+                + sum(map(sys.getsizeof, self._bodies.values())))
+
+    def encoded(self, encoding:str) -> bytes:
+        """Return the body in given encoding, compressed at first call"""
+        if encoding not in self._bodies:
+            self._bodies[encoding] = COMPRESSORS[encoding](self.body)
+        return self._bodies[encoding]
+
+    def compressed(self):
+        """Compress the body in all encodings now, rather than
+        at first request, and return the response.
+        Bodies too small to be sent compressed are not compressed."""
+        if len(self.body) >= MIN_COMPRESSED_SIZE:
+            for encoding in COMPRESSORS:
+                self.encoded(encoding)
+        return self
+
+    def not_modified(self, env) -> bool:
+        """True if the client already have this response,
+        according to the conditional headers of the request"""
+        if not self.cache_control:
+            return False
+        if_none_match = env.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:  # have precedence over If-Modified-Since
+            etags = {etag.strip() for etag in if_none_match.split(',')}
+            return '*' in etags or self.etag in etags or 'W/' + self.etag in etags
+        if_modified_since = env.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and self.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):  # invalid date
+                return False
+            return self.last_modified <= since
+        return False
+
+    def for_request(self, env) -> (str, list, list):
+        """Return status, headers and body to send to given request"""
+        headers = [('Vary', 'Accept-Encoding')]
+        if self.cache_control:
+            headers.append(('Cache-Control', self.cache_control))
+            headers.append(('ETag', self.etag))
+            if self.last_modified:
+                headers.append(('Last-Modified', formatdate(self.last_modified, usegmt=True)))
+        else:
+            headers.append(('Cache-Control', 'no-store'))
+        if self.not_modified(env):
+            return '304 Not Modified', headers, []
+        encoding = accepted_encoding(env.get('HTTP_ACCEPT_ENCODING', ''))
+        if len(self.body) < MIN_COMPRESSED_SIZE:
+            encoding = 'identity'
+        body = self.encoded(encoding)
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        headers += [('Content-Type', self.content_type),
+                    ('Content-Length', str(len(body)))]
+        return '200 OK', headers, [body]
+
+
+def accepted_encoding(accept_encoding:str) -> str:
+    """Return the preferred available encoding among the ones
+    accepted in given Accept-Encoding header value
+
+    >>> accepted_encoding('gzip, deflate')
+    'gzip'
+    >>> accepted_encoding('gzip;q=0')
+    'identity'
+    >>> accepted_encoding('')
+    'identity'
+
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        encoding, *params = item.strip().split(';')
+        if any(param.strip() in {'q=0', 'q=0.0', 'q=0.00', 'q=0.000'} for param in params):
+            continue
+        accepted.add(encoding.strip().lower())
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding in COMPRESSORS and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
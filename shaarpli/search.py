@@ -0,0 +1,162 @@
+"""Full-text search over title, description and url of links, and tags.
+
+The inverted index of a database is stored next to it, in a sidecar file
+with the .search extension. It is a SQLite database holding the posting
+list of each word, ordered by word then id, so that the links containing
+a word are read without scanning the others. Write-ahead logging allows
+readers to search while the index is updated.
+Tags are indexed as words prefixed by #, which no text word can be.
+
+A link is identified by its age: the number of links published before it.
+Publications do not change the id of the already indexed links, so
+the index is updated by indexing only the new links.
+The newest indexed link is also recorded: if it changed, the database
+was rewritten (import of older links for instance), and the index is emptied.
+
+Updates made while answering a request index at most INLINE_LINKS links:
+building the whole index, after the first run or a rewrite of the database,
+is left to indexsearch.py (also run by importlinks.py and convertdb.py).
+Meanwhile, only the links already indexed are found.
+
+"""
+
+
+import re
+import sqlite3
+import itertools
+import contextlib
+
+from shaarpli.index import file_lock
+
+
+SEARCH_EXT = '.search'
+WORD = re.compile(r'\w+')
+MAX_TERMS = 8  # words of a query beyond this number are ignored
+INLINE_LINKS = 1000  # maximal number of links indexed by an update not offline
+CACHE_KIB = 65536  # memory used by SQLite, mostly to speed up the first indexing
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    word TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (word, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+
+def words(text:str) -> set:
+    """Return the words of given text, as they are indexed
+
+    >>> sorted(words('Shaarli for CLI: http://shaarli.fr'))
+    ['cli', 'for', 'fr', 'http', 'shaarli']
+
+    """
+    return set(WORD.findall(text.lower()))
+
+
+def tag_word(tag:str) -> str:
+    """Return the word under which links with given tag are indexed"""
+    return '#' + tag.lower()
+
+
+def link_words(link) -> set:
+    """Return the words under which given link is found"""
+    return (words(link.title) | words(link.description) | words(link.url)
+            | set(map(tag_word, link.tags)))
+
+
+def link_key(link) -> str:
+    """Return a text identifying given link"""
+    return '\x1f'.join(map(str, link.to_dsv()))
+
+
+class SearchIndex:
+    """Inverted index of a database (see module documentation)"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.name = handler.name + SEARCH_EXT
+        self._postponed = None  # generation whose indexing is left to offline update
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.name, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA cache_size=-{}'.format(CACHE_KIB))
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _meta(self, connection) -> dict:
+        return dict(connection.execute('SELECT key, value FROM meta'))
+
+    def update(self, offline:bool=False) -> bool:
+        """Index the links published since last update,
+        or all of them if the database was rewritten.
+
+        Unless offline, nothing is indexed if there is more than
+        INLINE_LINKS links to index. Return True if the index is up to date.
+
+        """
+        generation = self.handler.generation()
+        if not offline and self._postponed == generation:
+            return False
+        with contextlib.closing(self._connect()) as connection:
+            if self._meta(connection).get('generation') == generation:
+                return True
+            with file_lock(self.handler.name), connection:
+                self.handler._changed()  # do not wait for check_delay
+                meta = self._meta(connection)
+                generation = self.handler.generation()
+                nb_link = self.handler.nb_link()
+                indexed = meta.get('indexed', 0)
+                if indexed:  # the newest indexed link must not have changed
+                    if (indexed > nb_link or meta.get('newest') !=
+                            link_key(next(self.handler.links_from(nb_link - indexed)))):
+                        print('Search index of {} do not match database anymore, '
+                              'and is rebuilt.'.format(self.handler.name))
+                        connection.execute('DELETE FROM postings')
+                        indexed = 0
+                        meta.update(indexed=0, newest=None)
+                if not offline and nb_link - indexed > INLINE_LINKS:
+                    print('Search index of {} lacks {} links: they will be found once'
+                          ' indexsearch.py is run.'.format(self.handler.name, nb_link - indexed))
+                    connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', meta.items())
+                    self._postponed = generation
+                    return False
+                # new links, from the newest
+                links = itertools.islice(self.handler.links_from(0), nb_link - indexed)
+                connection.executemany(
+                    'INSERT OR IGNORE INTO postings VALUES (?, ?)',
+                    ((word, nb_link - 1 - nb)
+                     for nb, link in enumerate(links) for word in link_words(link))
+                )
+                if nb_link > indexed:
+                    meta['newest'] = link_key(next(self.handler.links_from(0)))
+                meta.update(generation=generation, indexed=nb_link)
+                connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', meta.items())
+        return True
+
+    def search(self, query:str, start:int=0, size:int=10) -> tuple:
+        """Return the ids of the links containing all words of given query,
+        from the newest, skipping the *start* first ones"""
+        return self._search(sorted(words(query))[:MAX_TERMS], start, size)
+
+    def _search(self, terms:list, start:int, size:int) -> tuple:
+        if not terms:
+            return ()
+        self.update()
+        sql = ' INTERSECT '.join(['SELECT id FROM postings WHERE word = ?'] * len(terms))
+        with contextlib.closing(self._connect()) as connection:
+            rows = connection.execute(sql + ' ORDER BY id DESC LIMIT ? OFFSET ?',
+                                      (*terms, size, start))
+            return tuple(id for id, in rows)
+
+    def page(self, query:str, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1) of results
+        holding *size* links"""
+        return tuple(self.handler.links_by_id(self.search(query, (nb - 1) * size, size)))
+
+    def tag_page(self, tag:str, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1) of the links
+        having given tag, holding *size* links"""
+        ids = self._search([tag_word(tag)], (nb - 1) * size, size)
+        return tuple(self.handler.links_by_id(ids))
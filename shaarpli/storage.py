@@ -0,0 +1,356 @@
+"""Interface of the database handlers, and handler of SQLite databases.
+
+A database handler gives access to the links of a database, from the
+newest (or from the oldest for a queue), and adds links to it.
+Which one is used is defined by database.format in config:
+- dsv or binary: data.DatabaseHandler, links being records of a file
+  (see records.py)
+- sqlite: SQLiteHandler, links being rows of a SQLite database
+
+In a SQLite database, links are identified by consecutive integers,
+increasing with their age: a link is added with the next integer,
+dequeued links are the smallest ones, and a rewrite numbers them again.
+Counting the links or reaching the n-th one is then a lookup
+of the primary key. The database is expected to be modified by shaarpli
+only, which keeps the identifiers consecutive.
+Write-ahead logging allows readers to read while links are added.
+
+"""
+
+
+import os
+import time
+import sqlite3
+import itertools
+import threading
+import contextlib
+
+from shaarpli.commons import Link, file_state
+from shaarpli.index import Generation, GENERATION_EXT, file_lock
+
+
+SQLITE = 'sqlite'  # value of database.format
+EXTENSION = '.sqlite'
+FETCH_SIZE = 64  # number of links read at once when iterating
+CACHE_KIB = 16384  # memory used by SQLite for each connection
+COLUMNS = 'title, description, url, publication_date, tags'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    url TEXT NOT NULL,
+    publication_date NOT NULL,
+    tags TEXT NOT NULL DEFAULT ''
+);
+"""
+
+
+class StorageInterface:
+    """Methods expected from a database handler.
+
+    Number of links, emptiness, last link and generation are kept in memory
+    as long as the files of the database do not change. Files are stat-ed
+    at most once every *check_delay* seconds, so changes made by another
+    process may be seen with that delay.
+
+    newest_last -- True if links are stored from the oldest (see rewrite)
+    queue -- True if links are read from the oldest, and removed by dequeue
+
+    """
+    newest_last = queue = False
+
+    def __init__(self, name:str, check_delay:float=0.):
+        self.name = name
+        self.generation_file = Generation(name)
+        self.check_delay = float(check_delay)
+        self._checked = None  # (time of last check, state of files)
+        self._memo = {}  # name -> (state of files, value)
+
+    def files(self) -> tuple:
+        """Return the files whose modification is a change of the database,
+        the database itself being the first"""
+        raise NotImplementedError
+
+    def links_from(self, nb:int) -> iter:
+        """Yield links of the database, from the newest (oldest for a queue),
+        starting at the *nb*-th (from 0)"""
+        raise NotImplementedError
+
+    def links_oldest_first(self) -> iter:
+        """Yield links of the database, from the oldest"""
+        raise NotImplementedError
+
+    def links_by_id(self, ids:iter) -> iter:
+        """Yield the links of given ids, the id of a link being the number
+        of links published before it (see search.py).
+        Ids of links not in database are ignored."""
+        raise NotImplementedError
+
+    def extend(self, links:iter):
+        """Add given Link instances to the database, holding its lock.
+        Links are given from the newest, or from the oldest for a queue."""
+        raise NotImplementedError
+
+    def rewrite(self, links:iter) -> int:
+        """Replace all links of the database by given ones, given from
+        the newest, or from the oldest if newest_last or queue is set.
+        Return the number of links."""
+        raise NotImplementedError
+
+    def dequeue(self, nb:int, compaction_threshold:int):
+        """Remove the *nb* first links from the queue"""
+        raise NotImplementedError
+
+    def nb_link(self) -> int:
+        """Returns the number of link in the database"""
+        raise NotImplementedError
+
+    def generation(self) -> int:
+        """Return the generation of the database, increased at each change"""
+        raise NotImplementedError
+
+
+    @property
+    def links(self):
+        return iter(self)
+
+    def __iter__(self):
+        return self.links_from(0)
+
+    def links_between(self, start:int, stop:int) -> tuple:
+        """Return the links from the *start*-th to the *stop*-th (excluded),
+        in the order of links_from"""
+        return tuple(itertools.islice(self.links_from(start), max(0, stop - start)))
+
+    def page(self, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1)
+        holding *size* links"""
+        return self.links_between((nb - 1) * size, nb * size)
+
+    def archive_page(self, nb:int, size:int) -> tuple:
+        """Return the links of the *nb*-th page (from 1) holding *size* links,
+        pages being counted from the oldest link"""
+        stop = self.nb_link() - (nb - 1) * size  # links up to the page end
+        start = max(0, stop - size)
+        if stop <= 0:
+            return ()
+        return self.links_between(start, stop)
+
+    @property
+    def last_link(self) -> Link or None:
+        """Return the last published link in database, or None if no link
+        in database."""
+        def last_link():
+            try:
+                return next(iter(self))
+            except StopIteration:
+                return None
+        return self._memoized('last_link', last_link)
+
+    def empty(self) -> bool:
+        """True if databate contains nothing"""
+        return self._state()[0] is None or self.nb_link() == 0
+
+    def out_of_date(self, generation:int) -> bool:
+        """True if database have changed since given generation"""
+        return generation != self.generation()
+
+    def publication_state(self) -> list:
+        """Return [generation, number of links, fields of the newest link],
+        to be given later to published_since. It can be stored as JSON."""
+        newest = self.last_link
+        return [self.generation(), self.nb_link(), list(newest.to_dsv()) if newest else None]
+
+    def published_since(self, state:list or None) -> tuple or None:
+        """Return the links published since given publication state,
+        from the newest, or None if the links changed otherwise,
+        like by a rewrite merging older links, or if state is None.
+
+        Links were only published if the previously newest link is now
+        preceded by as many links as the number of new ones.
+
+        """
+        if state is None:
+            return None
+        generation, nb_link, newest = state
+        if generation == self.generation():
+            return ()
+        nb_new = self.nb_link() - nb_link
+        if nb_new <= 0:  # changed without new links
+            return None
+        links = tuple(itertools.islice(self.links_from(0), nb_new + 1))
+        previous_newest = list(links[nb_new].to_dsv()) if len(links) > nb_new else None
+        return links[:nb_new] if previous_newest == newest else None
+
+    def last_modified(self) -> float or None:
+        """Timestamp of last modification of database, or None if no database"""
+        state = self._state()
+        if state[0] is None:
+            return None
+        return max(file[0] for file in state if file) / 10**9
+
+    def _state(self) -> tuple:
+        """State of the files of the database (see file_state),
+        checked at most once every check_delay seconds"""
+        now = time.monotonic()
+        if self._checked is None or now - self._checked[0] >= self.check_delay:
+            self._checked = now, tuple(map(file_state, self.files()))
+        return self._checked[1]
+
+    def _memoized(self, name:str, compute:callable):
+        """Return the value of given name, computed again only
+        if the files changed since last computation"""
+        state = self._state()
+        if name not in self._memo or self._memo[name][0] != state:
+            self._memo[name] = state, compute()
+        return self._memo[name][1]
+
+    def _changed(self, **values):
+        """To be called after a write: check the files immediately,
+        and memoize given values for their new state"""
+        self._checked = None
+        state = self._state()
+        self._memo = {name: (state, value) for name, value in values.items()}
+
+
+class SQLiteHandler(StorageInterface):
+    """Access to a SQLite database (see module documentation).
+
+    Each thread uses its own connection. Links are read by blocks
+    of FETCH_SIZE, each one being read at once.
+
+    """
+    newest_last = True
+
+    def __init__(self, filename:str, queue:bool=False, check_delay:float=0.):
+        super().__init__(filename, check_delay)
+        self.queue = bool(queue)
+        self._local = threading.local()
+        self._connect()  # create the database
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():  # not inherited
+            connection = sqlite3.connect(self.name, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA cache_size=-{}'.format(CACHE_KIB))
+            connection.execute(SCHEMA.format(table='links'))
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Hold the write lock of the database, and the connection
+        of the current thread in a transaction"""
+        with file_lock(self.name):
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            self.generation_file.increment()
+        self._changed()
+
+    def _bounds(self) -> (int, int):
+        """Return the smallest and greatest identifiers, or (1, 0) if no link"""
+        first, last = self._connect().execute(  # each one optimized alone by SQLite
+            'SELECT (SELECT min(id) FROM links), (SELECT max(id) FROM links)'
+        ).fetchone()
+        return (1, 0) if first is None else (first, last)
+
+    def _select(self, condition:str, order:str, parameters:tuple) -> list:
+        return [Link.from_dsv(row) for row in self._connect().execute(
+            'SELECT {} FROM links WHERE {} ORDER BY id {}'.format(COLUMNS, condition, order),
+            parameters
+        )]
+
+    def _links(self, start:int, stop:int, step:int) -> iter:
+        """Yield the links of identifiers in range(start, stop, step),
+        FETCH_SIZE at a time"""
+        for block_start in range(start, stop, step * FETCH_SIZE):
+            block_stop = block_start + step * FETCH_SIZE
+            if step > 0:
+                yield from self._select('id >= ? AND id < ?', 'ASC',
+                                        (block_start, min(block_stop, stop)))
+            else:
+                yield from self._select('id <= ? AND id > ?', 'DESC',
+                                        (block_start, max(block_stop, stop)))
+
+    def files(self) -> tuple:
+        return self.name, self.name + '-wal', self.name + GENERATION_EXT
+
+    def links_from(self, nb:int) -> iter:
+        first, last = self._bounds()
+        if self.queue:
+            return self._links(first + nb, last + 1, 1)
+        return self._links(last - nb, first - 1, -1)
+
+    def links_between(self, start:int, stop:int) -> tuple:
+        first, last = self._bounds()
+        if self.queue:
+            return tuple(self._select('id >= ? AND id < ?', 'ASC',
+                                      (first + start, min(first + stop, last + 1))))
+        return tuple(self._select('id <= ? AND id > ?', 'DESC',
+                                  (last - start, max(last - stop, first - 1))))
+
+    def links_oldest_first(self) -> iter:
+        first, last = self._bounds()
+        return self._links(first, last + 1, 1)
+
+    def links_by_id(self, ids:iter) -> iter:
+        first, last = self._bounds()
+        for id in ids:
+            if 0 <= id <= last - first:
+                yield from self._select('id = ?', 'ASC', (first + id,))
+
+    def extend(self, links:iter):
+        links = tuple(links)
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT INTO links ({}) VALUES (?, ?, ?, ?, ?)'.format(COLUMNS),
+                (self._row(link) for link in (links if self.queue else reversed(links)))
+            )
+
+    def rewrite(self, links:iter) -> int:
+        with self._transaction() as connection:
+            # links may be read from the current table while written
+            connection.execute('DROP TABLE IF EXISTS links_new')
+            connection.execute(SCHEMA.format(table='links_new'))
+            connection.executemany(
+                'INSERT INTO links_new ({}) VALUES (?, ?, ?, ?, ?)'.format(COLUMNS),
+                map(self._row, links)
+            )
+            connection.execute('DROP TABLE links')
+            connection.execute('ALTER TABLE links_new RENAME TO links')
+        return self.nb_link()
+
+    @staticmethod
+    def _row(link:Link) -> tuple:
+        return (link.title, link.description, link.url,
+                link.publication_date, ' '.join(link.tags))
+
+    def dequeue(self, nb:int, compaction_threshold:int=None):
+        """Remove the *nb* first links from the queue.
+
+        Space of removed links is reused by SQLite: there is no compaction.
+
+        """
+        assert self.queue, "SQLiteHandler must be a queue to dequeue links"
+        with self._transaction() as connection:
+            first, _ = self._bounds()
+            connection.execute('DELETE FROM links WHERE id < ?', (first + nb,))
+
+    def nb_link(self) -> int:
+        def count():
+            first, last = self._bounds()
+            return last - first + 1
+        return self._memoized('nb_link', count)
+
+    def generation(self) -> int:
+        return self._memoized('generation', self.generation_file.get)
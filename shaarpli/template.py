@@ -1,15 +1,31 @@
-"""Provides API for template generation"""
+"""Provides API for template generation
+
+Templates are read and compiled once, then kept in memory.
+Their files are checked for modification at most once
+every template.reload_delay seconds.
+
+Links are rendered in html one by one, and kept in a cache of fragments:
+rendering a page only needs the markdown of links never rendered before,
+and of the page around them.
+
+"""
 
 
 import time
+import string
+import hashlib
+import threading
+from urllib.parse import quote
 
 import markdown
-from shaarpli.commons import Link, file_content
+from shaarpli import metrics
+from shaarpli.cache import SLFUCache
+from shaarpli.commons import Link, file_content, file_state
 
 
 TEMPLATE_LINK = """
 ## [{title}]({url})
-{publication_date}  
+{publication_date} {tags}  
 {description}
 """
 TEMPLATE_LINK_SEP = """
@@ -29,8 +45,96 @@ TEMPLATE_PAGE = """
 {additional_footer}
 """
 
+BODY_MARK = 'shaarpli-body-placeholder'  # replaced by the links in html page
+SUBTITLE_MARK = 'shaarpli-subtitle-placeholder'  # replaced by the subtitle when served
+FORMATTER = string.Formatter()
+FILES = {}  # filename -> CachedFile
+FRAGMENTS = None  # content hash -> html of a link, created with the first page
+FRAGMENTS_LOCK = threading.Lock()
+
+
+class CachedFile:
+    """Content of a file, kept in memory and reloaded when the file changes.
+
+    The file is stat-ed at most once every *delay* seconds.
+    If the file doesn't exist, *onfail* is used as content.
+
+    The file is checked and loaded by one thread at a time, and the time
+    of the check is recorded once the content is loaded: threads asking
+    for the content meanwhile wait for it, or get the previous one.
+
+    """
+
+    def __init__(self, filename:str, onfail:str='', delay:float=1.):
+        self.filename = filename
+        self.onfail = onfail
+        self.delay = float(delay)
+        self.last_check = None
+        self.signature = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return the up to date loaded content"""
+        now = time.monotonic()
+        if self.last_check is None or now - self.last_check >= self.delay:
+            with self.lock:
+                if self.last_check is None or now - self.last_check >= self.delay:
+                    signature = file_state(self.filename)
+                    if self.version == 0 or signature != self.signature:
+                        self.load(file_content(self.filename, onfail=self.onfail))
+                        self.signature = signature
+                        self.version += 1
+                    self.last_check = now
+        return self.content
+
+    def load(self, content:str):
+        self.content = content
+
+
+class Template(CachedFile):
+    """A template file in python format, compiled when loaded.
+
+    Rendering is then a join of the literal parts and formatted fields.
+    Templates using more than field names (attributes, indexes, conversions)
+    are rendered with str.format.
+    The compiled template is replaced at once when reloaded,
+    so that threads rendering it meanwhile use either version.
+
+    """
+
+    def load(self, content:str):
+        parts = tuple(FORMATTER.parse(content))
+        simple = all(
+            name is None or (name.isidentifier() and not conversion)
+            for _, name, _, conversion in parts
+        )
+        self.compiled = content, parts, simple
+        self.content = self
+
+    def format(self, **fields) -> str:
+        source, parts, simple = self.compiled
+        if not simple:
+            return source.format(**fields)
+        return ''.join(
+            literal if name is None else literal + format(fields[name], spec)
+            for literal, name, spec, _ in parts
+        )
+
+
+def cached(filename:str, onfail:str, config, cls=CachedFile) -> CachedFile:
+    """Return the content of given file, from the registry"""
+    if filename not in FILES:  # a single instance, even if created by several threads
+        FILES.setdefault(filename, cls(filename, onfail, config.template.reload_delay))
+    return FILES[filename].get()
+
+
+def template(filename:str, onfail:str, config) -> Template:
+    """Return the compiled template of given file, from the registry"""
+    return cached(filename, onfail, config, cls=Template)
+
 
-def render_link(link:Link, template:str, config) -> str:
+def render_link(link:Link, template:Template or str, config) -> str:
     """Render a single link in markdown"""
     fields = link.asdict()
     t = time.localtime(fields['publication_date'])
@@ -38,12 +142,37 @@ def render_link(link:Link, template:str, config) -> str:
         fields['publication_date'] = time.strftime(config.template.time_format, t)
     else:  # no time format -> user do not want time
         fields['publication_date'] = ''
+    fields['tags'] = ' '.join('[#{0}]({1}/tag/{2})'.format(tag, config.server.url, quote(tag))
+                              for tag in link.tags)
     return template.format(**fields)
 
 
-def footer(config, page_number, links) -> str:
-    """Build and return the footer in markdown"""
-    base_url = config.server.url
+def render_link_html(link:Link, template:Template, config) -> str:
+    """Render a single link in html, using the cache of fragments"""
+    global FRAGMENTS
+    key = hashlib.blake2b(
+        repr((link.to_dsv(), template.version, config.template.time_format)).encode(),
+        digest_size=16
+    ).digest()
+    with FRAGMENTS_LOCK:
+        if FRAGMENTS is None:
+            FRAGMENTS = SLFUCache(config.server.fragment_cache_memory)
+        html = FRAGMENTS.get(key)
+    if html is None:
+        html = markdown.markdown(render_link(link, template, config))
+        with FRAGMENTS_LOCK:
+            if FRAGMENTS.maxsize > 0:
+                FRAGMENTS[key] = html
+    return html
+
+
+def footer(config, page_number, links, prefix:str='') -> str:
+    """Build and return the footer in markdown.
+
+    prefix -- path between base url and page number, like '/archive'
+
+    """
+    base_url = config.server.url + prefix
     prev_page, next_page = page_number - 1, page_number + 1
     link_prev = '/{}'.format(prev_page) if prev_page > 0 else ''
     link_next = '/{}'.format(next_page) if next_page > 0 else ''
@@ -78,29 +207,49 @@ def subtitle(config, db) -> str:
 
 
 def render_full_page(config, page_number:int, links:tuple, db,
-                     *, as_html:bool=True) -> str:
+                     *, as_html:bool=True, prefix:str='',
+                     subtitle_text:str=None) -> str:
     """Full page in html (or markdown if not as_html).
 
     config -- a namedtuple containing the configuration (see config.py)
     page_number -- integer >= 1 giving the page number
     links -- tuple of Link instances
     as_html -- return markdown if False, html if True
+    prefix -- path of pages between base url and page number (see footer)
+    subtitle_text -- subtitle to use instead of the one computed from db
 
     """
-    template_link = file_content(config.template.link, onfail=TEMPLATE_LINK)
-    template_page = file_content(config.template.page, onfail=TEMPLATE_PAGE)
-    template_link_sep = file_content(config.template.page, onfail=TEMPLATE_LINK_SEP)
+    template_link = template(config.template.link, TEMPLATE_LINK, config)
+    template_page = template(config.template.page, TEMPLATE_PAGE, config)
+    template_link_sep = cached(config.template.link_separator, TEMPLATE_LINK_SEP, config)
+
+    page_fields = {
+        'title': config.html.title,
+        'additional_header': cached(config.html.additional_header, '', config),
+        'additional_footer': cached(config.html.additional_footer, '', config),
+        'subtitle': subtitle(config, db) if subtitle_text is None else subtitle_text,
+    }
+    print('Page {} generated with {} links.'.format(page_number, len(links)))
+
+    if as_html:  # join the html of links in the html page
+        with metrics.span('render_links'):
+            all_links = tuple(render_link_html(link, template_link, config) for link in links)
+        with metrics.span('markdown'):
+            html = markdown.markdown(template_page.format(
+                body=BODY_MARK,
+                footer=footer(config, page_number, all_links, prefix),
+                **page_fields
+            ))
+        body_mark = '<p>{}</p>'.format(BODY_MARK)
+        if body_mark in html:
+            separator = '\n{}\n'.format(markdown.markdown(template_link_sep))
+            return html.replace(body_mark, separator.join(all_links))
+        # template do not put the body in its own paragraph: render it all
 
     all_links = tuple(render_link(link, template_link, config) for link in links)
-    merged_links = template_link_sep.join(all_links)
-
     md = template_page.format(
-        title=config.html.title,
-        body=merged_links,
-        footer=footer(config, page_number, all_links),
-        additional_header=file_content(config.html.additional_header),
-        additional_footer=file_content(config.html.additional_footer),
-        subtitle=subtitle(config, db),
+        body=template_link_sep.join(all_links),
+        footer=footer(config, page_number, all_links, prefix),
+        **page_fields
     )
-    print('Page {} generated with {} links.'.format(page_number, len(all_links)))
     return markdown.markdown(md) if as_html else md
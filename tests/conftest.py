@@ -0,0 +1,38 @@
+"""Fixtures shared by the tests: databases are created in a temporary
+directory, with a configuration built from the default one."""
+
+
+import configparser
+import pytest
+
+from shaarpli import config as config_module
+from shaarpli.commons import Link
+
+
+@pytest.fixture
+def make_links():
+    """Return a function returning *nb* links, from the oldest,
+    the first one being published at *start*"""
+    def make_links(nb:int, start:int=1500000000, prefix:str='link') -> list:
+        return [Link('{} {}'.format(prefix, nb), 'description of\n"{}"'.format(nb),
+                     'https://example.org/{}'.format(nb), start + nb * 60, ('tag{}'.format(nb % 3),))
+                for nb in range(nb)]
+    return make_links
+
+
+@pytest.fixture
+def make_config(tmpdir):
+    """Return a function returning a configuration whose databases
+    are in a temporary directory, overriding given options by section,
+    like make_config(database={'format': 'binary'})"""
+    def make_config(**sections) -> tuple:
+        config = configparser.ConfigParser()
+        config.read_string(config_module.DEFAULT_CONFIG)
+        config.set('database', 'filepath', str(tmpdir.join('data.csv')))
+        config.set('database', 'check_delay_ms', '0')
+        config.set('autopublish', 'filepath', str(tmpdir.join('topublish.csv')))
+        for section, options in sections.items():
+            for option, value in options.items():
+                config.set(section, option, str(value))
+        return config_module.as_namedtuple(config)
+    return make_config
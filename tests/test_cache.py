@@ -0,0 +1,57 @@
+"""Tests of the caches bounded by memory"""
+
+
+from shaarpli.cache import SLFUCache, SharedCache, MemoryBudget, sizeof
+from shaarpli.response import Response
+
+
+def test_missing_key_is_not_stored():
+    cache = SLFUCache(1000)
+    assert cache.get('missing') is None and len(cache) == 0
+    assert cache.stats()['misses'] == 1
+
+
+def test_memory_bounds():
+    budget = MemoryBudget(1000)
+    cache, other = SLFUCache(1000, budget=budget), SLFUCache(1000, budget=budget)
+    value = 'x' * 100
+    cache['big'] = 'x' * 2000  # larger than the cache
+    assert 'big' not in cache
+    for key in range(20):
+        cache[key] = value
+    other['key'] = value
+    assert cache.currsize == sizeof(value) * len(cache)
+    assert budget.used() <= 1000 and cache.evictions > 0 and 'key' in other
+
+
+def test_shared_cache(tmpdir):
+    cache, other = (SharedCache(10, str(tmpdir), 'tags') for _ in range(2))
+    key = ('tag' * 200, 1)  # too long for a filename
+    cache[key] = 'page'
+    assert other.get(key) == 'page' and key in other and ('tag', 1) not in other
+    assert list(other) == [key] and len(other) == 1
+    other.invalidate()
+    assert cache.get(key) is None and len(cache) == 0
+
+
+def test_shared_cache_keeps_compressed_bodies(tmpdir):
+    cache = SharedCache(10, str(tmpdir), 'rendering')
+    cache[1] = Response('<p>page</p>' * 100).compressed()
+    assert 'gzip' in cache[1]._bodies
+
+
+def test_peek_is_not_counted():
+    cache = SLFUCache(1000)
+    cache['key'] = 'value'
+    assert cache.peek('key') == 'value' and cache.peek('missing') is None
+    assert cache.get('key') == 'value'
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 0)
+
+
+def test_compressed_response_keeps_its_size():
+    cache = SLFUCache(100000)
+    cache[1] = response = Response('<p>page</p>' * 100).compressed()
+    size = cache.currsize
+    response.for_request({'HTTP_ACCEPT_ENCODING': 'gzip'})
+    assert sizeof(response) == size
+    assert list(Response('<p>small</p>').compressed()._bodies) == ['identity']
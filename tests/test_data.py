@@ -0,0 +1,42 @@
+"""Tests of the database handlers stored in files, and of their aggregation"""
+
+
+from shaarpli.data import DatabaseHandler, HandlerAggregator, new_handler
+
+
+def test_empty_database(tmpdir):
+    handler = DatabaseHandler(str(tmpdir.join('data.csv')))
+    assert handler.empty() and handler.nb_link() == 0
+    assert list(handler.links) == [] and list(handler.links_oldest_first()) == []
+    assert handler.page(1, 10) == () and handler.last_link is None
+    assert list(handler.links_by_id([0, 1])) == []
+
+
+def test_empty_queue(tmpdir, make_config, make_links):
+    queue = new_handler(make_config(), str(tmpdir.join('topublish.csv')), queue=True)
+    assert list(queue.links) == [] and queue.nb_link() == 0
+    queue.extend(make_links(2))
+    queue.dequeue(2, compaction_threshold=1 << 20)
+    assert list(queue.links) == [] and queue.nb_link() == 0 and queue.empty()
+
+
+def test_move_from_empty_queue(make_config, make_links):
+    db = HandlerAggregator(make_config(autopublish={'active': 'true', 'every': 1}))
+    db.move_entry_if_expected()  # expected, since nothing is published
+    assert db.move_entry(1) == 0 and db.nb_link() == 0
+    db.publish_later(make_links(1))
+    assert db.move_entry(5) == 1 and db.move_entry(1) == 0
+    assert [link.title for link in db.links] == ['link 0']
+
+
+def test_invalid_records_are_ignored(tmpdir, make_links):
+    database = tmpdir.join('data.csv')
+    handler = DatabaseHandler(str(database))
+    handler.extend(make_links(2))
+    database.write_binary(database.read_binary()
+                          + 'bad\x1fdate\x1fhttp://bad\x1fnotadate\n'.encode()
+                          + 'too\x1ffew\n'.encode())
+    links = handler.page(1, 10)
+    assert sorted(link.title for link in links) == ['link 0', 'link 1']
+    assert all(link.publication_date for link in links)
+    assert len(tuple(handler.links_by_id(range(4)))) == 2
@@ -0,0 +1,57 @@
+"""Tests of the static export of the site"""
+
+
+import threading
+
+from shaarpli import export, importer
+from shaarpli.data import HandlerAggregator
+
+
+def wait_exports():
+    for thread in threading.enumerate():
+        if thread.name == 'export':
+            thread.join()
+
+
+def test_export_in_background(tmpdir, make_config, make_links):
+    directory = tmpdir.join('site')
+    config = make_config(autopublish={'active': 'true', 'every': 'year'},
+                         export={'directory': str(directory)},
+                         html={'link_per_page': 2})
+    db = HandlerAggregator(config)
+    db.publish_later(make_links(3, prefix='later'))
+    db.publish(make_links(6))
+    wait_exports()
+    assert 'next 3 years' in directory.join(export.SUBTITLE).read()
+    first_archive = directory.join('archive', '1', 'index.html')
+    assert export.INCLUDE.format('', export.SUBTITLE) in first_archive.read()
+    mtime = first_archive.mtime()
+    db.move_entry(1)
+    wait_exports()
+    assert 'next 2 years' in directory.join(export.SUBTITLE).read()
+    assert first_archive.mtime() == mtime  # full archive pages are not written again
+    assert 'later 0' in directory.join('index.html').read()
+    assert not [path for path in directory.visit() if path.basename.endswith('.tmp')]
+
+
+def test_archive_pages_exported_again_after_rewrite(tmpdir, make_config, make_links):
+    directory = tmpdir.join('site')
+    config = make_config(export={'directory': str(directory)}, html={'link_per_page': 2})
+    db = HandlerAggregator(config)
+    db.publish(reversed(make_links(6, start=1600000000)))
+    db.export()
+    first_archive = directory.join('archive', '1', 'index.html')
+    assert 'link 0' in first_archive.read()
+    importer.import_links(make_links(1, prefix='old'), db.target)  # older than all links
+    db.export()
+    assert 'old 0' in first_archive.read()
+    links = list(db.links)
+    links[-1] = make_links(1, prefix='renamed')[0]
+    db.target.rewrite(links)  # same number of links
+    db.export()
+    assert 'renamed 0' in first_archive.read()
+    db.publish(make_links(1, start=1700000000, prefix='new'))
+    mtime = first_archive.mtime()
+    db.export()
+    assert 'new 0' in directory.join('index.html').read()
+    assert first_archive.mtime() == mtime
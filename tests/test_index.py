@@ -0,0 +1,137 @@
+"""Tests of the sidecar files of databases: offset index and head cursor"""
+
+
+import os
+import shutil
+import threading
+
+from shaarpli.data import DatabaseHandler, new_handler
+from shaarpli.index import OffsetIndex, scan_offsets, tempname
+from shaarpli.records import DSV
+
+
+THRESHOLD = 1 << 20  # compaction threshold never reached
+
+
+def new_queue(config, filename:str) -> DatabaseHandler:
+    return new_handler(config, filename, queue=True)
+
+
+def queue_of(tmpdir, make_config, make_links, nb:int) -> DatabaseHandler:
+    queue = new_queue(make_config(), str(tmpdir.join('topublish.csv')))
+    queue.extend(make_links(nb, prefix='q'))
+    return queue
+
+
+def titles(handler) -> list:
+    return [link.title for link in handler.links]
+
+
+def replace_by_copy(database:str, content:bytes=None):
+    """Replace given database by a new file, as an editor or a copy would"""
+    with open(database + '.new', 'wb') as fd:
+        if content is None:
+            with open(database, 'rb') as previous:
+                shutil.copyfileobj(previous, fd)
+        else:
+            fd.write(content)
+    os.replace(database + '.new', database)
+
+
+def test_index_matches_records(tmpdir, make_links):
+    handler = DatabaseHandler(str(tmpdir.join('data.csv')))
+    for nb in range(3):
+        handler.extend(make_links(nb + 1))
+    handler.index.refresh()
+    assert list(handler.index.offsets()) == list(scan_offsets(handler.name, DSV)[1])
+    assert handler.nb_link() == 6
+
+
+def test_dequeue_moves_head(tmpdir, make_config, make_links):
+    queue = queue_of(tmpdir, make_config, make_links, 5)
+    queue.dequeue(2, THRESHOLD)
+    assert titles(queue) == ['q 2', 'q 3', 'q 4'] and queue.nb_link() == 3
+    assert os.path.getsize(queue.name) > 0  # not compacted
+    queue.dequeue(10, THRESHOLD)
+    assert titles(queue) == [] and queue.nb_link() == 0
+
+
+def test_compaction(tmpdir, make_config, make_links):
+    queue = queue_of(tmpdir, make_config, make_links, 5)
+    size = os.path.getsize(queue.name)
+    queue.dequeue(3, compaction_threshold=1)
+    assert titles(queue) == ['q 3', 'q 4'] and queue.nb_link() == 2
+    assert os.path.getsize(queue.name) < size
+    queue.extend(make_links(1, prefix='r'))
+    queue.dequeue(1, THRESHOLD)
+    assert titles(queue) == ['q 4', 'r 0']
+
+
+def test_head_found_in_copied_queue(tmpdir, make_config, make_links):
+    queue = queue_of(tmpdir, make_config, make_links, 5)
+    queue.dequeue(3, THRESHOLD)
+    replace_by_copy(queue.name)
+    assert titles(queue) == ['q 3', 'q 4']
+    queue.dequeue(1, THRESHOLD)
+    assert titles(queue) == ['q 4']
+
+
+def test_head_found_in_queue_without_dequeued_links(tmpdir, make_config, make_links):
+    queue = queue_of(tmpdir, make_config, make_links, 5)
+    queue.dequeue(3, THRESHOLD)
+    with open(queue.name, 'rb') as fd:
+        content = fd.read()
+    replace_by_copy(queue.name, content[queue.index.offset(3):])
+    assert titles(queue) == ['q 3', 'q 4']
+
+
+def test_unknown_queue_is_not_dequeued_again(tmpdir, make_config, make_links):
+    queue = queue_of(tmpdir, make_config, make_links, 5)
+    queue.dequeue(3, THRESHOLD)
+    other = new_queue(make_config(), str(tmpdir.join('other.csv')))
+    other.extend(make_links(2, prefix='other'))
+    with open(other.name, 'rb') as fd:
+        replace_by_copy(queue.name, fd.read())
+    assert titles(queue) == []
+    os.remove(queue.head.name)
+    assert titles(queue) == ['other 0', 'other 1']
+
+
+def test_temporary_names_are_proper_to_threads(tmpdir):
+    names, barrier = [], threading.Barrier(4)
+
+    def name():  # idents of threads are unique while they are alive
+        names.append(tempname('data.csv'))
+        barrier.wait()
+
+    threads = [threading.Thread(target=name) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(names + [tempname('data.csv')])) == 5
+
+
+def test_index_written_by_concurrent_threads(tmpdir, make_links):
+    database = str(tmpdir.join('data.csv'))
+    with open(database, 'wb') as fd:
+        fd.write(DSV.encode(link.to_dsv() for link in make_links(10))[0])
+    errors = []
+
+    def write():
+        index = OffsetIndex(database, DSV)
+        try:
+            for _ in range(50):
+                index.write(scan_offsets(database, DSV)[1])
+        except OSError as error:  # temporary file replaced by another thread
+            errors.append(error)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not OffsetIndex(database, DSV).refresh()
+    assert len(OffsetIndex(database, DSV)) == 10
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')]
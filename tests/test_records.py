@@ -0,0 +1,58 @@
+"""Tests of the encodings of database records"""
+
+
+import pytest
+
+from shaarpli import records
+from shaarpli.data import new_handler
+from shaarpli.index import scan_offsets
+
+
+ROWS = [('title', 'multi\nline "quoted"', 'https://example.org', '1500000000'),
+        ('tagged', '', 'u', '1500000060', 'a b'),
+        ('unicode é ✓', 'x' * 3000, 'u', '1500000120')]
+
+
+@pytest.mark.parametrize('record_format', [records.DSV, records.BINARY])
+def test_encoding_round_trip(tmpdir, record_format):
+    database = tmpdir.join('data')
+    data, offsets = record_format.encode(ROWS)
+    database.write_binary(data)
+    with open(str(database), 'rb') as fd:
+        assert [tuple(row) for _, row in record_format.read(fd)] == ROWS
+        with record_format.mapped(fd) as source:
+            assert [tuple(row) for row in record_format.rows(source, offsets)] == ROWS
+            assert [tuple(row) for row in record_format.rows(source, offsets[1:2], offsets[2])] == ROWS[1:2]
+            assert [tuple(row) for row in record_format.rows(source, offsets[::2])] == ROWS[::2]
+            assert [tuple(record_format.row_at(source, offset)) for offset in offsets] == ROWS
+            assert record_format.row_at(source, len(data)) is None
+
+
+def test_conversion_round_trip(tmpdir):
+    dsv, binary, back = (str(tmpdir.join(name)) for name in ('data.csv', 'data.bin', 'back.csv'))
+    with open(dsv, 'wb') as fd:
+        fd.write(records.DSV.encode(ROWS)[0])
+    assert records.convert(dsv, records.DSV, binary, records.BINARY) == len(ROWS)
+    assert records.convert(binary, records.BINARY, back, records.DSV) == len(ROWS)
+    with open(dsv, 'rb') as original, open(back, 'rb') as converted:
+        assert original.read() == converted.read()
+
+
+@pytest.mark.parametrize('database_format', ['dsv', 'binary'])
+def test_handlers_of_formats(tmpdir, make_config, make_links, database_format):
+    config = make_config(database={'format': database_format})
+    handler = new_handler(config, str(tmpdir.join('data')))
+    handler.extend(make_links(150)[::-1])
+    assert [link.title for link in handler.page(2, 10)] == ['link {}'.format(nb) for nb in range(139, 129, -1)]
+    assert [link.title for link in handler.links_by_id([0, 149, 150])] == ['link 0', 'link 149']
+    assert [link.tags for link in handler.links][:2] == [('tag2',), ('tag1',)]
+    assert handler.nb_link() == len(tuple(handler.links_oldest_first())) == 150
+
+
+@pytest.mark.parametrize('record_format', [records.DSV, records.BINARY])
+def test_invalid_records_are_not_indexed(tmpdir, record_format):
+    database = tmpdir.join('data')
+    rows = ROWS[:1] + [('bad', 'date', 'u', 'not a date'), ('too', 'few')] + ROWS[1:]
+    data, offsets = record_format.encode(rows)
+    database.write_binary(data)
+    assert list(scan_offsets(str(database), record_format)[1]) == [offsets[0]] + list(offsets[3:])
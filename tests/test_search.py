@@ -0,0 +1,32 @@
+"""Tests of the inverted index of the links"""
+
+
+from shaarpli import search
+from shaarpli.data import new_handler
+from shaarpli.search import SearchIndex
+
+
+def test_large_updates_are_offline(monkeypatch, tmpdir, make_config, make_links):
+    monkeypatch.setattr(search, 'INLINE_LINKS', 5)
+    handler = new_handler(make_config(), str(tmpdir.join('data.csv')))
+    handler.extend(make_links(10)[::-1])
+    index = SearchIndex(handler)
+    assert not index.update() and index.page('link', 1, 20) == ()
+    assert index.update(offline=True)
+    assert len(index.page('link', 1, 20)) == 10
+    handler.extend(make_links(2, start=2000000000, prefix='new')[::-1])
+    assert index.update()  # few new links: indexed inline
+    assert [link.title for link in index.page('new', 1, 20)] == ['new 1', 'new 0']
+    assert [link.title for link in index.tag_page('tag1', 1, 2)] == ['new 1', 'link 7']
+
+
+def test_rewritten_database_is_not_searched(monkeypatch, tmpdir, make_config, make_links):
+    monkeypatch.setattr(search, 'INLINE_LINKS', 5)
+    handler = new_handler(make_config(), str(tmpdir.join('data.csv')))
+    handler.extend(make_links(10)[::-1])
+    index = SearchIndex(handler)
+    index.update(offline=True)
+    handler.rewrite(make_links(10, prefix='other')[::-1])
+    assert not index.update() and index.page('link', 1, 20) == ()
+    index.update(offline=True)
+    assert len(index.page('other', 1, 20)) == 10
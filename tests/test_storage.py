@@ -0,0 +1,130 @@
+"""Tests of the database handlers, whatever their storage"""
+
+
+import threading
+
+import pytest
+
+from shaarpli.data import DatabaseHandler, new_handler
+
+
+FORMATS = ['dsv', 'binary', 'sqlite']
+
+
+def new_database(tmpdir, make_config, database_format:str, queue:bool=False, **options):
+    config = make_config(database=dict(options, format=database_format))
+    return new_handler(config, str(tmpdir.join('queue' if queue else 'data')), queue=queue)
+
+
+def titles(links) -> list:
+    return [link.title for link in links]
+
+
+@pytest.mark.parametrize('append_only', [False, True])
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_extend_and_read(tmpdir, make_config, make_links, database_format, append_only):
+    database = new_database(tmpdir, make_config, database_format, append_only=append_only)
+    assert database.empty() and database.nb_link() == 0 and database.last_link is None
+    links = make_links(130)
+    database.extend(reversed(links[:100]))
+    database.extend(reversed(links[100:]))
+    assert database.nb_link() == 130
+    assert database.last_link.title == 'link 129'
+    assert titles(database.page(1, 3)) == ['link 129', 'link 128', 'link 127']
+    assert titles(database.page(13, 10)) == ['link 9', 'link 8', 'link 7', 'link 6', 'link 5',
+                                              'link 4', 'link 3', 'link 2', 'link 1', 'link 0']
+    assert titles(database.links_oldest_first()) == titles(links)
+    assert titles(database.links_by_id([129, 0, 64, 130])) == ['link 129', 'link 0', 'link 64']
+    assert tuple(database.links)[64].to_dsv() == links[65].to_dsv()
+
+
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_rewrite(tmpdir, make_config, make_links, database_format):
+    database = new_database(tmpdir, make_config, database_format)
+    database.extend(reversed(make_links(20)))
+    generation = database.generation()
+    links = make_links(5, prefix='new')  # given from the newest, unless newest_last
+    assert database.rewrite(links if database.newest_last else reversed(links)) == 5
+    assert database.generation() > generation
+    assert database.nb_link() == 5
+    assert titles(database.links) == ['new 4', 'new 3', 'new 2', 'new 1', 'new 0']
+    assert titles(database.links_by_id([0])) == ['new 0']
+
+
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_queue(tmpdir, make_config, make_links, database_format):
+    queue = new_database(tmpdir, make_config, database_format, queue=True)
+    queue.extend(make_links(10, prefix='q'))
+    queue.dequeue(4, 1 << 20)
+    assert queue.nb_link() == 6
+    assert titles(queue.links) == ['q {}'.format(nb) for nb in range(4, 10)]
+    queue.extend(make_links(1, prefix='late'))
+    queue.dequeue(6, 1 << 20)
+    assert titles(queue.links) == ['late 0']
+    queue.dequeue(1, 1 << 20)
+    assert queue.empty()
+
+
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_concurrent_extend(tmpdir, make_config, make_links, database_format):
+    database = new_database(tmpdir, make_config, database_format)
+    links = make_links(200)
+    batches = [links[start:start + 20] for start in range(0, len(links), 20)]
+    threads = [threading.Thread(target=database.extend, args=(reversed(batch),)) for batch in batches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert database.nb_link() == 200
+    assert sorted(titles(database.links)) == sorted(titles(links))
+    for batch in batches:  # each batch is written at once
+        written = titles(database.links)
+        start = written.index(batch[-1].title)
+        assert written[start:start + 20] == titles(reversed(batch))
+    if isinstance(database, DatabaseHandler):
+        assert not database.index.refresh()  # index written along the links
+        assert len(database.index) == 200
+
+
+@pytest.mark.parametrize('database_format', ['dsv', 'binary'])
+def test_snapshot_read_while_rewritten(tmpdir, make_config, make_links, database_format):
+    database = new_database(tmpdir, make_config, database_format)
+    database.extend(reversed(make_links(300)))
+    links = iter(database.links)
+    first = next(links)
+    database.rewrite(reversed(make_links(10, prefix='new')))
+    database.extend(make_links(1, prefix='newer'))
+    assert titles([first, *links]) == ['link {}'.format(nb) for nb in range(299, -1, -1)]
+    assert titles(database.page(1, 2)) == ['newer 0', 'new 9']
+
+
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_changes_seen_by_other_handlers(tmpdir, make_config, make_links, database_format):
+    database = new_database(tmpdir, make_config, database_format)
+    other = new_database(tmpdir, make_config, database_format)
+    database.extend(reversed(make_links(3)))
+    assert other.nb_link() == 3
+    generation = other.generation()
+    database.extend(make_links(1, prefix='new'))
+    assert other.generation() > generation
+    assert other.nb_link() == 4
+    assert other.last_link.title == 'new 0'
+
+
+@pytest.mark.parametrize('database_format', FORMATS)
+def test_published_since(tmpdir, make_config, make_links, database_format):
+    database = new_database(tmpdir, make_config, database_format)
+    assert database.published_since(None) is None
+    links = make_links(10)
+    database.extend(reversed(links[2:8]))
+    state = database.publication_state()
+    assert database.published_since(state) == ()
+    database.extend(reversed(links[8:]))
+    assert titles(database.published_since(state)) == ['link 9', 'link 8']
+    state = database.publication_state()
+    merged = links if database.newest_last else reversed(links)  # older links merged
+    database.rewrite(merged)
+    assert database.published_since(state) is None
+    state = database.publication_state()
+    database.rewrite(database.links_oldest_first() if database.newest_last else database.links)
+    assert database.published_since(state) is None  # rewritten without new links
@@ -0,0 +1,41 @@
+"""Tests of the templates kept in memory"""
+
+
+import time
+import threading
+
+from shaarpli import template
+
+
+def test_template_loaded_once_by_concurrent_threads(tmpdir, monkeypatch):
+    filename = tmpdir.join('page.html')
+    filename.write('<b>{title}</b>')
+    file_state = template.file_state
+    monkeypatch.setattr(template, 'file_state', lambda name: time.sleep(0.05) or file_state(name))
+    cached = template.Template(str(filename), delay=60)
+    results, barrier = [], threading.Barrier(8)
+
+    def render():
+        barrier.wait()
+        try:
+            results.append(cached.get().format(title='x'))
+        except Exception as error:
+            results.append(error)
+
+    threads = [threading.Thread(target=render) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['<b>x</b>'] * 8
+    assert cached.version == 1
+
+
+def test_template_reloaded_when_changed(tmpdir):
+    filename = tmpdir.join('page.html')
+    filename.write('<b>{title}</b>')
+    cached = template.Template(str(filename), delay=0)
+    assert cached.get().format(title='x') == '<b>x</b>'
+    filename.write('<i>{title!r}</i>')
+    assert cached.get().format(title='x') == "<i>'x'</i>"
+    assert cached.version == 2